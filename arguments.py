@@ -0,0 +1,167 @@
+import argparse
+from materialize import MODES
+from sharding import parse_shard
+
+# Command-line parsers of the pipeline steps. Each step's cli() builds its
+# parser here, and cli.py parses a command's arguments before importing the
+# step, so --help and usage errors never pay for importing cv2, numpy or
+# pandas. Keep this module (and everything it imports) free of them.
+
+# Output formats for tabular results. 'parquet' and 'arrow' need pyarrow;
+# 'arrow' is an uncompressed Arrow IPC (Feather v2) file that can be
+# memory-mapped and read without copying.
+FORMATS = ('csv', 'parquet', 'arrow')
+
+# Output codecs:
+#   png    - PNG with OpenCV's default compression
+#   png:N  - PNG with compression level N (0 = fastest/largest, 9 = slowest/smallest)
+#   webp   - lossless WebP
+#   npy    - raw NumPy array, no encoding at all
+#   skip   - don't write the image (only for debug artifacts)
+CODECS = ('png', 'png:0', 'png:1', 'png:3', 'png:6', 'png:9', 'webp', 'npy', 'skip')
+
+# Values searched by default for each binarize parameter
+DEFAULT_GRID = {
+    'block_size': (7, 11, 15, 21, 31),
+    'C': (0, 2, 4, 8),
+    'kernel_size': (1, 3, 5)
+}
+
+def int_list(text):
+    """Parse a comma-separated list of integers, for argparse."""
+    try:
+        return [int(value) for value in text.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected comma-separated integers: {text}")
+
+def extract_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Extract ellipse parameters from the overlayed images.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes (default: CPU count, 1 = serial)")
+    parser.add_argument("--chunksize", type=int, default=16,
+                        help="Images submitted to a worker per task (default: 16)")
+    parser.add_argument("--format", choices=FORMATS, default='csv',
+                        help="Output format for the ellipse parameters (default: csv)")
+    parser.add_argument("--debug-codec", choices=CODECS, default='png',
+                        help="Codec for the mask_analysis/ verification images, or 'skip' (default: png)")
+    parser.add_argument("--profile-report", default=None,
+                        help="Save per-step timing percentiles to this JSON file")
+    parser.add_argument("--coarse-scale", type=float, default=None,
+                        help="Locate the overlay on an image downsampled by this factor, then detect in a full-resolution ROI around it")
+    parser.add_argument("--validate-coarse", action="store_true",
+                        help="Also run the full-resolution fit and add delta_* accuracy columns to the results")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run from its journal instead of starting over")
+    parser.add_argument("--checkpoint-every", type=int, default=64,
+                        help="Images analyzed between journal fsyncs (default: 64)")
+    parser.add_argument("--shard", type=parse_shard, default=None,
+                        help="Only analyze shard i of N (e.g. 0/4), saving partial results for --merge-shards")
+    parser.add_argument("--merge-shards", type=int, default=None, metavar="N",
+                        help="Combine the partial results of N finished shards instead of analyzing images")
+    return parser
+
+def organize_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Match the dataset images with their metadata.")
+    parser.add_argument("--mode", choices=MODES, default='copy',
+                        help="How images are placed in matched_dataset (default: copy)")
+    parser.add_argument("--format", choices=FORMATS, default='csv',
+                        help="Output format for matched_data (default: csv)")
+    return parser
+
+def masks_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Generate ellipse overlays from the annotation images.")
+    parser.add_argument("--force", action="store_true",
+                        help="Regenerate every overlay, ignoring the overlay manifest")
+    parser.add_argument("--read-ahead", type=int, default=8,
+                        help="Image pairs to prefetch ahead of processing (default: 8)")
+    parser.add_argument("--write-queue", type=int, default=8,
+                        help="Overlays allowed to be pending on the writer pool (default: 8)")
+    parser.add_argument("--io-threads", type=int, default=4,
+                        help="Threads in each of the reader and writer pools (default: 4)")
+    parser.add_argument("--codec", choices=[c for c in CODECS if c != 'skip'], default='png',
+                        help="Output codec for the overlays (default: png)")
+    parser.add_argument("--profile-report", default=None,
+                        help="Save per-step timing percentiles to this JSON file")
+    parser.add_argument("--checkpoint-every", type=int, default=64,
+                        help="Overlays written between journal fsyncs (default: 64)")
+    parser.add_argument("--shard", type=parse_shard, default=None,
+                        help="Only process shard i of N (e.g. 0/4), with a per-shard manifest for --merge-shards")
+    parser.add_argument("--merge-shards", type=int, default=None, metavar="N",
+                        help="Combine the manifests of N finished shards instead of processing images")
+    return parser
+
+def partition_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Partition the overlays into train/val/test splits.")
+    parser.add_argument("--mode", choices=MODES, default='copy',
+                        help="How images are placed in the splits (default: copy)")
+    parser.add_argument("--profile-report", default=None,
+                        help="Save per-step timing percentiles to this JSON file")
+    return parser
+
+def correlate_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Match the partitioned overlays with their metadata.")
+    parser.add_argument("--format", choices=FORMATS, default='csv',
+                        help="Output format for the metadata tables (default: csv)")
+    parser.add_argument("--profile-report", default=None,
+                        help="Save per-step timing percentiles to this JSON file")
+    return parser
+
+def sweep_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Sweep the detection thresholding parameters against the annotation ellipses.")
+    parser.add_argument("--overlay-dir", default="data/Ultrasound Fetus Dataset/OverlayedImages",
+                        help="Overlayed images to detect ellipses in")
+    parser.add_argument("--annotation-dir", default="data/Ultrasound Fetus Dataset/matched_dataset",
+                        help="Directory with the *_Annotation.png ground truth")
+    parser.add_argument("--output", default="parameter_sweep.csv", help="Ranked table of parameter sets")
+    parser.add_argument("--format", choices=FORMATS, default='csv',
+                        help="Output format for the ranking (default: csv)")
+    parser.add_argument("--block-sizes", type=int_list, default=list(DEFAULT_GRID['block_size']),
+                        help="adaptiveThreshold block sizes (default: %(default)s)")
+    parser.add_argument("--constants", type=int_list, default=list(DEFAULT_GRID['C']),
+                        help="adaptiveThreshold constants (default: %(default)s)")
+    parser.add_argument("--kernel-sizes", type=int_list, default=list(DEFAULT_GRID['kernel_size']),
+                        help="Morphology kernel sizes (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes (default: CPU count, 1 = serial)")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Only use the first N images (by image number)")
+    parser.add_argument("--top", type=int, default=10, help="Parameter sets to print (default: 10)")
+    return parser
+
+def export_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Pack the partitioned splits into memory-mapped arrays.")
+    parser.add_argument("--height", type=int, default=224, help="Image height (default: 224)")
+    parser.add_argument("--width", type=int, default=224, help="Image width (default: 224)")
+    return parser
+
+def pipeline_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Run the whole dataset pipeline as a single streaming pass.")
+    parser.add_argument("--queue-size", type=int, default=8,
+                        help="Maximum records buffered between stages (default: 8)")
+    parser.add_argument("--codec", choices=[c for c in CODECS if c != 'skip'], default='png',
+                        help="Output codec for the overlays (default: png)")
+    parser.add_argument("--render-workers", type=int, default=0,
+                        help="Render overlays in this many worker processes via shared memory (default: 0, in-process)")
+    return parser
+
+def synthetic_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Generate a synthetic ultrasound dataset for benchmarking.")
+    parser.add_argument("root", help="Directory to write the dataset to")
+    parser.add_argument("-n", "--n-images", type=int, default=100, help="Number of images (default: 100)")
+    parser.add_argument("--height", type=int, default=480, help="Image height (default: 480)")
+    parser.add_argument("--width", type=int, default=640, help="Image width (default: 640)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    return parser
+
+# cli.py command name -> parser of the step it runs
+PARSERS = {
+    'extract': extract_parser,
+    'organize': organize_parser,
+    'masks': masks_parser,
+    'partition': partition_parser,
+    'correlate': correlate_parser,
+    'sweep': sweep_parser,
+    'export': export_parser,
+    'pipeline': pipeline_parser,
+    'synthetic': synthetic_parser
+}
@@ -0,0 +1,239 @@
+import os
+import re
+import sqlite3
+import argparse
+import threading
+import time
+
+# Default location of the catalog database
+CATALOG_PATH = os.environ.get('MHF_CATALOG', '.dataset_catalog.sqlite')
+
+CATEGORIES = ('normal', 'benign', 'malignant')
+SPLITS = ('train', 'val', 'test')
+
+# Filesystem timestamps are coarse, so a directory modified within this long
+# of being scanned could change again without its mtime moving. Such
+# directories are re-listed on the next lookup (like git's "racy" entries).
+RACY_WINDOW_NS = 2_000_000_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    image_number INTEGER,
+    category TEXT,
+    role TEXT,
+    split TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    PRIMARY KEY (dir, name)
+);
+CREATE INDEX IF NOT EXISTS entries_image ON entries (image_number);
+"""
+
+def file_role(name):
+    """Classify a file by name: annotation, overlay, debug (mask_analysis), original or other."""
+    stem, ext = os.path.splitext(name)
+    if ext.lower() not in ('.png', '.jpg', '.jpeg', '.webp', '.npy'):
+        return 'other'
+    if stem.endswith('_Annotation'):
+        return 'annotation'
+    if stem.startswith('overlay_'):
+        return 'overlay'
+    if stem.startswith(('mask_', 'ellipse_')):
+        return 'debug'
+    return 'original'
+
+def file_image_number(name):
+    """Extract the dataset image number from a file name, or None."""
+    match = re.match(r'(?:overlay_|mask_|ellipse_)?(\d+)_', name)
+    return int(match.group(1)) if match else None
+
+class Catalog:
+    """
+    Persistent SQLite index of the files in the dataset trees.
+
+    A directory is only re-listed when its mtime has changed since it was
+    last indexed, so repeated listings cost one stat of the directory
+    instead of a listing plus a stat per file. Directory mtimes change when
+    entries are added, removed or renamed, but not when a file is rewritten
+    in place; use refresh(root, full=True) after such changes.
+    """
+
+    def __init__(self, db_path=CATALOG_PATH):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _refresh_dir(self, path, full=False):
+        """Re-index a single directory if it changed. Returns True if it was re-listed."""
+        st = os.stat(path)
+        with self.lock:
+            row = self.conn.execute("SELECT mtime_ns FROM dirs WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[0] == st.st_mtime_ns and not full:
+            return False
+
+        scanned_ns = time.time_ns()
+        parts = path.split(os.sep)
+        category = next((p for p in reversed(parts) if p in CATEGORIES), None)
+        split = next((p for p in reversed(parts) if p in SPLITS), None)
+        rows = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    rows.append((path, entry.name, 1, None, None, None, None, None, None))
+                elif entry.is_file():
+                    entry_st = entry.stat()
+                    rows.append((path, entry.name, 0, file_image_number(entry.name), category,
+                                 file_role(entry.name), split, entry_st.st_size, entry_st.st_mtime_ns))
+
+        listed = {row[1] for row in rows if row[2]}
+        with self.lock, self.conn:
+            # Forget the subtrees of subdirectories that are gone
+            for (name,) in self.conn.execute(
+                    "SELECT name FROM entries WHERE dir = ? AND is_dir = 1", (path,)).fetchall():
+                if name not in listed:
+                    self._forget(os.path.join(path, name))
+            self.conn.execute("DELETE FROM entries WHERE dir = ?", (path,))
+            self.conn.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            racy = st.st_mtime_ns >= scanned_ns - RACY_WINDOW_NS
+            self.conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?)", (path, -1 if racy else st.st_mtime_ns))
+        return True
+
+    def _forget(self, path):
+        """Drop a directory and everything indexed below it. Call with the lock held."""
+        prefix = path + os.sep
+        for table, column in (('entries', 'dir'), ('dirs', 'path')):
+            self.conn.execute(f"DELETE FROM {table} WHERE {column} = ? OR substr({column}, 1, ?) = ?",
+                              (path, len(prefix), prefix))
+
+    def refresh(self, root, full=False):
+        """
+        Bring the index of everything under root up to date.
+
+        Returns the number of directories that had to be re-listed.
+        """
+        relisted = 0
+        pending = [os.path.abspath(root)]
+        while pending:
+            path = pending.pop()
+            relisted += self._refresh_dir(path, full)
+            pending.extend(os.path.join(path, name) for name in self._names(path, is_dir=True))
+        return relisted
+
+    def _names(self, path, is_dir):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT name FROM entries WHERE dir = ? AND is_dir = ? ORDER BY rowid", (path, int(is_dir))).fetchall()
+        return [name for (name,) in rows]
+
+    def listdir(self, path, suffix=None):
+        """List the files in a directory, like os.listdir but without subdirectories."""
+        path = os.path.abspath(path)
+        self._refresh_dir(path)
+        names = self._names(path, is_dir=False)
+        return [n for n in names if n.endswith(suffix)] if suffix else names
+
+    def files(self, path, suffix=None):
+        """
+        List the files in a directory as dicts with name, image_number,
+        category, role, split, size and mtime_ns.
+        """
+        path = os.path.abspath(path)
+        self._refresh_dir(path)
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT name, image_number, category, role, split, size, mtime_ns FROM entries "
+                "WHERE dir = ? AND is_dir = 0 ORDER BY rowid", (path,)).fetchall()
+        columns = ['name', 'image_number', 'category', 'role', 'split', 'size', 'mtime_ns']
+        return [dict(zip(columns, row)) for row in rows if not suffix or row[0].endswith(suffix)]
+
+    def subdirs(self, path):
+        """List the subdirectories of a directory."""
+        path = os.path.abspath(path)
+        self._refresh_dir(path)
+        return self._names(path, is_dir=True)
+
+    def query(self, root, **filters):
+        """
+        Return the indexed files under root as dicts, optionally filtered by
+        image_number, category, role or split.
+        """
+        root = os.path.abspath(root)
+        self.refresh(root)
+        prefix = root + os.sep
+        # substr rather than LIKE, which is case-insensitive and would also match /x/Root for /x/root
+        sql = ("SELECT dir, name, image_number, category, role, split, size, mtime_ns FROM entries "
+               "WHERE is_dir = 0 AND (dir = ? OR substr(dir, 1, ?) = ?)")
+        params = [root, len(prefix), prefix]
+        for column, value in filters.items():
+            if column not in ('image_number', 'category', 'role', 'split'):
+                raise ValueError(f"Unknown catalog filter: {column}")
+            sql += f" AND {column} = ?"
+            params.append(value)
+        with self.lock:
+            rows = self.conn.execute(sql + " ORDER BY rowid", params).fetchall()
+        columns = ['dir', 'name', 'image_number', 'category', 'role', 'split', 'size', 'mtime_ns']
+        return [dict(zip(columns, row)) for row in rows]
+
+_default_catalog = None
+
+def default_catalog():
+    """The catalog shared by the pipeline scripts, opened on first use."""
+    global _default_catalog
+    if _default_catalog is None:
+        _default_catalog = Catalog()
+    return _default_catalog
+
+def summarize(entries):
+    """Count entries by (category, role, split)."""
+    counts = {}
+    for entry in entries:
+        key = (entry['category'] or '-', entry['role'] or '-', entry['split'] or '-')
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+def cli(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Index a dataset tree and count or list its files.")
+    parser.add_argument("root", nargs='?', default="data/Ultrasound Fetus Dataset",
+                        help="Directory to index (default: data/Ultrasound Fetus Dataset)")
+    parser.add_argument("--full", action="store_true",
+                        help="Re-stat every file, not just directories whose mtime changed")
+    parser.add_argument("--category", choices=CATEGORIES, default=None, help="Only files of this category")
+    parser.add_argument("--role", choices=('original', 'annotation', 'overlay', 'debug', 'other'), default=None,
+                        help="Only files with this role")
+    parser.add_argument("--split", choices=SPLITS, default=None, help="Only files in this split")
+    parser.add_argument("--image-number", type=int, default=None, help="Only files of this image")
+    parser.add_argument("--list", action="store_true", help="Print matching paths instead of counts")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.root):
+        parser.error(f"not a directory: {args.root}")
+
+    filters = {column: getattr(args, column) for column in ('category', 'role', 'split', 'image_number')
+               if getattr(args, column) is not None}
+    catalog = default_catalog()
+    if args.full:
+        catalog.refresh(args.root, full=True)
+    entries = catalog.query(args.root, **filters)
+    if args.list:
+        for entry in entries:
+            print(os.path.join(entry['dir'], entry['name']))
+        return
+    print(f"{'category':<10} {'role':<11} {'split':<6} {'files':>7}")
+    for (category, role, split), count in sorted(summarize(entries).items()):
+        print(f"{category:<10} {role:<11} {split:<6} {count:>7}")
+    print(f"{len(entries)} files indexed in {catalog.db_path}")
+
+if __name__ == "__main__":
+    cli()
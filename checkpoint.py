@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+from contextlib import contextmanager
+
+def file_hash(path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def fsync_dir(directory):
+    """Flush a directory entry (e.g. after a rename) to disk, where supported."""
+    try:
+        fd = os.open(directory or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+@contextmanager
+def atomic_output(path):
+    """
+    Write an output file crash-safely.
+
+    Yields a temporary path next to path (keeping its extension) to write
+    to. When the block finishes, the file is fsynced and renamed over path,
+    so path always holds either the previous complete output or the new
+    one. If the block raises, the temporary file is removed.
+    """
+    directory, name = os.path.split(str(path))
+    stem, ext = os.path.splitext(name)
+    tmp_path = os.path.join(directory, f".{stem}.partial{ext}")
+    try:
+        yield tmp_path
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    fsync_dir(directory)
+
+class Journal:
+    """
+    Append-only JSON-lines journal of completed records.
+
+    Every record is flushed to the OS as soon as it is appended, so a killed
+    process loses nothing; the file is fsynced every sync_every records, so
+    a machine crash loses at most that many.
+
+    With resume=True the existing journal is replayed into self.records
+    (dropping a final line torn by a crash) and new records are appended
+    after it. Otherwise the journal starts out empty.
+    """
+
+    def __init__(self, path, sync_every=64, resume=False):
+        self.path = str(path)
+        self.sync_every = max(sync_every, 1)
+        self.records = self._replay() if resume else []
+        self.file = open(self.path, 'a' if resume else 'w')
+        self.unsynced = 0
+
+    def _replay(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+
+        records = []
+        valid = 0
+        for line in data.splitlines(keepends=True):
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError("incomplete line")
+                records.append(json.loads(line))
+            except ValueError:
+                break
+            valid += len(line)
+
+        # Cut off a torn final write so new records start on a clean line
+        if valid < len(data):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid)
+        return records
+
+    def append(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
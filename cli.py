@@ -0,0 +1,56 @@
+import sys
+import argparse
+import importlib
+from arguments import PARSERS
+
+# Subcommands: name -> (module providing cli(argv, prog), description).
+# A module is only imported when its command runs, so listing commands or
+# running a metadata-only command never pays for importing cv2 or pandas.
+# Commands with a parser in arguments.PARSERS are parsed before the import,
+# so their --help and usage errors don't pay for it either.
+COMMANDS = {
+    'download': ('download_dataset', "Download the dataset and ingest it into the data directory"),
+    'catalog': ('catalog', "Index a dataset tree and count or list its files"),
+    'extract': ('extract_ellipse_params', "Extract ellipse parameters from the overlayed images"),
+    'organize': ('organize_dataset', "Match the dataset images with their metadata"),
+    'masks': ('generate_masks', "Generate ellipse overlays from the annotation images"),
+    'partition': ('partition_dataset', "Partition the overlays into train/val/test splits"),
+    'correlate': ('correlate_metadata', "Match the partitioned overlays with their metadata"),
+    'sweep': ('parameter_sweep', "Sweep the detection thresholding parameters against the annotations"),
+    'export': ('export_dataset', "Pack the partitioned splits into memory-mapped arrays"),
+    'pipeline': ('pipeline', "Run the whole dataset pipeline as a single streaming pass"),
+    'synthetic': ('synthetic_dataset', "Generate a synthetic ultrasound dataset for benchmarking"),
+    'benchmark': ('benchmark', "Run micro-benchmarks on synthetic images")
+}
+
+def build_parser(prog=None):
+    listing = "\n".join(f"  {name:<12} {description}" for name, (_, description) in COMMANDS.items())
+    parser = argparse.ArgumentParser(
+        prog=prog, usage="%(prog)s command [args ...]",
+        description="Run a step of the dataset pipeline. Use '%(prog)s command --help' for its options.",
+        epilog=f"commands:\n{listing}", formatter_class=argparse.RawDescriptionHelpFormatter)
+    return parser
+
+def run_command(name, argv=(), prog=None):
+    """Import the module behind a command and run its cli() with argv."""
+    module, _ = COMMANDS[name]
+    prog = f"{prog or 'cli.py'} {name}"
+    if name in PARSERS:
+        # Exits on --help or bad arguments before the module is imported
+        PARSERS[name](prog).parse_args(list(argv))
+    return importlib.import_module(module).cli(list(argv), prog=prog)
+
+def main(argv=None, prog=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    parser = build_parser(prog)
+    # Only the command name is parsed here; its options go to the command's own parser
+    if not argv or argv[0].startswith('-'):
+        parser.parse_args(argv)
+        parser.print_help()
+        return
+    if argv[0] not in COMMANDS:
+        parser.error(f"unknown command: {argv[0]} (choose from {', '.join(COMMANDS)})")
+    return run_command(argv[0], argv[1:], parser.prog)
+
+if __name__ == "__main__":
+    main()
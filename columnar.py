@@ -0,0 +1,210 @@
+import os
+import csv
+import math
+import pandas as pd
+from checkpoint import atomic_output
+from arguments import FORMATS
+
+EXTENSIONS = {
+    'csv': '.csv',
+    'parquet': '.parquet',
+    'arrow': '.arrow'
+}
+
+CATEGORY_DTYPE = pd.CategoricalDtype(['normal', 'benign', 'malignant'])
+SPLIT_DTYPE = pd.CategoricalDtype(['train', 'val', 'test'])
+
+# Column types for each table. Columns not listed keep the dtype pandas gave them.
+ELLIPSE_SCHEMA = {
+    'image': 'string',
+    'category': CATEGORY_DTYPE,
+    'center_x': 'float32',
+    'center_y': 'float32',
+    'major_axis': 'float32',
+    'minor_axis': 'float32',
+    'angle': 'float32',
+    'aspect_ratio': 'float32',
+    'contour_area': 'float32',
+    'contour_perimeter': 'float32',
+    'circularity': 'float32'
+}
+
+SPLIT_METADATA_SCHEMA = {
+    'image_number': 'int32',
+    'image_filename': 'string',
+    'category': CATEGORY_DTYPE,
+    'split': SPLIT_DTYPE
+}
+
+MATCHED_SCHEMA = {
+    'image_number': 'int32',
+    'image_filename': 'string',
+    'has_annotation': 'bool',
+    'original_category': CATEGORY_DTYPE,
+    'corrected_category': CATEGORY_DTYPE
+}
+
+def _require_pyarrow(fmt):
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError(f"The '{fmt}' output format requires pyarrow (pip install pyarrow)") from None
+    return pyarrow
+
+def apply_schema(df, schema):
+    """Cast the columns of df that appear in schema to their declared types."""
+    return df.astype({column: dtype for column, dtype in schema.items() if column in df.columns})
+
+def table_path(path, fmt):
+    """Swap the extension of path for the one used by fmt."""
+    return os.path.splitext(str(path))[0] + EXTENSIONS[fmt]
+
+def write_table(df, path, fmt='csv', schema=None):
+    """
+    Write a results table in the given format.
+
+    CSV output is written exactly as DataFrame.to_csv(path, index=False) so
+    existing consumers are unaffected. Every format is written atomically
+    (see checkpoint.atomic_output), so a crash never leaves a partial table. Parquet and Arrow output is cast to
+    schema first so readers get the declared dtypes without inference.
+
+    Returns the path written, with its extension matching fmt.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown table format: {fmt} (expected one of {', '.join(FORMATS)})")
+
+    path = table_path(path, fmt)
+    if fmt == 'csv':
+        with atomic_output(path) as tmp_path:
+            df.to_csv(tmp_path, index=False)
+        return path
+
+    pa = _require_pyarrow(fmt)
+    if schema is not None:
+        df = apply_schema(df, schema)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    with atomic_output(path) as tmp_path:
+        if fmt == 'parquet':
+            import pyarrow.parquet as pq
+            pq.write_table(table, tmp_path)
+        else:
+            import pyarrow.feather as feather
+            feather.write_feather(table, tmp_path, compression='uncompressed')
+    return path
+
+def csv_value(value):
+    """Format a value the way DataFrame.to_csv does (missing values as empty fields)."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ''
+    return value
+
+class TableWriter:
+    """
+    Write a results table one row at a time, without holding it in memory.
+
+    CSV output is identical to write_table(pd.DataFrame(rows), path) as long
+    as every row has the same keys and float columns hold floats. Parquet and
+    Arrow rows are buffered and written in batches of batch_size rows, cast
+    to schema like write_table. The file only appears at path (atomically)
+    once the writer is closed without an error.
+    """
+
+    def __init__(self, path, fmt='csv', schema=None, batch_size=4096):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown table format: {fmt} (expected one of {', '.join(FORMATS)})")
+        if fmt != 'csv':
+            _require_pyarrow(fmt)
+        self.path = table_path(path, fmt)
+        self.fmt = fmt
+        self.schema = schema
+        self.batch_size = batch_size
+        self.columns = None
+        self.count = 0
+        self.batch = []
+        self.batch_writer = None
+        self._output = atomic_output(self.path)
+        self.tmp_path = self._output.__enter__()
+        if fmt == 'csv':
+            self.file = open(self.tmp_path, 'w', newline='')
+            self.csv = csv.writer(self.file, lineterminator=os.linesep)
+
+    def write(self, row):
+        if self.columns is None:
+            self.columns = list(row)
+            if self.fmt == 'csv':
+                self.csv.writerow(self.columns)
+        self.count += 1
+        if self.fmt == 'csv':
+            self.csv.writerow([csv_value(row[column]) for column in self.columns])
+            return
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_size:
+            self._write_batch()
+
+    def _write_batch(self):
+        pa = _require_pyarrow(self.fmt)
+        df = pd.DataFrame(self.batch, columns=self.columns)
+        if self.schema is not None:
+            df = apply_schema(df, self.schema)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.batch_writer is None:
+            if self.fmt == 'parquet':
+                import pyarrow.parquet as pq
+                self.batch_writer = pq.ParquetWriter(self.tmp_path, table.schema)
+            else:
+                self.batch_writer = pa.ipc.new_file(self.tmp_path, table.schema)
+        self.batch_writer.write_table(table)
+        self.batch = []
+
+    def close(self):
+        """Finish writing and move the table into place."""
+        if self.fmt == 'csv':
+            self.file.close()
+        else:
+            if self.batch or self.batch_writer is None:
+                self._write_batch()
+            self.batch_writer.close()
+        self._output.__exit__(None, None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        # Leave any previous table at path untouched
+        if self.fmt == 'csv':
+            self.file.close()
+        elif self.batch_writer is not None:
+            self.batch_writer.close()
+        self._output.__exit__(exc_type, exc, traceback)
+
+def load_table(path, as_pandas=True, schema=None):
+    """
+    Load a table written by write_table.
+
+    Arrow files are memory-mapped, so with as_pandas=False the returned
+    pyarrow Table references the file's pages directly; converting to pandas
+    keeps numeric columns zero-copy where pyarrow allows it. CSV files are
+    read with pandas and cast to schema if one is given.
+    """
+    ext = os.path.splitext(str(path))[1]
+    if ext == EXTENSIONS['csv']:
+        df = pd.read_csv(path)
+        return apply_schema(df, schema) if schema is not None else df
+
+    if ext == EXTENSIONS['parquet']:
+        _require_pyarrow('parquet')
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, memory_map=True)
+    elif ext == EXTENSIONS['arrow']:
+        pa = _require_pyarrow('arrow')
+        table = pa.ipc.open_file(pa.memory_map(str(path), 'r')).read_all()
+    else:
+        raise ValueError(f"Unknown table extension: {path}")
+
+    if not as_pandas:
+        return table
+    return table.to_pandas(split_blocks=True)
@@ -1,16 +1,39 @@
 import os
 import pandas as pd
 from pathlib import Path
-import re
+from image_io import IMAGE_EXTENSIONS
+from catalog import default_catalog
+from profiling import PROFILER
+from columnar import write_table, EXTENSIONS, SPLIT_METADATA_SCHEMA
+from arguments import correlate_parser
 
-def extract_image_number(filename):
-    """Extract the image number from the filename."""
-    match = re.match(r'overlay_(\d+)_', filename)
-    if match:
-        return int(match.group(1))
-    return None
+def build_split_index(partitioned_dir, catalog=None):
+    """
+    Look up the partitioned overlays in the catalog, one DataFrame row per image.
+    
+    Columns are image_number, image_filename, category and split.
+    """
+    catalog = catalog or default_catalog()
+    rows = []
+    for split in ['train', 'val', 'test']:
+        for category in ['normal', 'benign', 'malignant']:
+            category_path = os.path.join(partitioned_dir, split, category)
+            if not os.path.exists(category_path):
+                continue
+            
+            # Get all overlay images in this category
+            for entry in catalog.files(category_path, IMAGE_EXTENSIONS):
+                img_file = entry['name']
+                img_number = entry['image_number'] if entry['role'] == 'overlay' else None
+                if img_number is None:
+                    print(f"Warning: Could not extract image number from {img_file}")
+                    continue
+                
+                rows.append((img_number, img_file, category, split))
+    
+    return pd.DataFrame(rows, columns=['image_number', 'image_filename', 'category', 'split'])
 
-def correlate_metadata(partitioned_dir, original_csv_path, output_dir):
+def correlate_metadata(partitioned_dir, original_csv_path, output_dir, fmt='csv'):
     """
     Correlate partitioned overlays with their metadata from the original CSV.
     
@@ -18,6 +41,7 @@ def correlate_metadata(partitioned_dir, original_csv_path, output_dir):
         partitioned_dir: Directory containing the partitioned overlays
         original_csv_path: Path to the original FetusDataset.csv
         output_dir: Directory to save the correlated metadata CSVs
+        fmt: Output format for the metadata tables ('csv', 'parquet' or 'arrow')
     """
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
@@ -25,49 +49,43 @@ def correlate_metadata(partitioned_dir, original_csv_path, output_dir):
     # Read the original dataset
     original_df = pd.read_csv(original_csv_path)
     
+    # Index every overlay in a single directory scan
+    with PROFILER.timer('correlate_metadata.scan'):
+        index_df = build_split_index(partitioned_dir)
+    
+    # Note: image numbers in the dataset are 1-based, while DataFrame index is 0-based
+    in_dataset = index_df['image_number'] <= len(original_df)
+    for img_number in index_df.loc[~in_dataset, 'image_number']:
+        print(f"Warning: Image number {img_number} not found in original dataset")
+    index_df = index_df[in_dataset].reset_index(drop=True)
+    
+    # Look up every image's metadata row at once
+    with PROFILER.timer('correlate_metadata.join'):
+        metadata_df = original_df.iloc[index_df['image_number'].to_numpy() - 1].reset_index(drop=True)
+        metadata_df = metadata_df.assign(
+            image_number=index_df['image_number'],
+            image_filename=index_df['image_filename'],
+            category=index_df['category'],
+            split=index_df['split']
+        )
+    
     # Process each split
     for split in ['train', 'val', 'test']:
-        split_data = []
         split_path = os.path.join(partitioned_dir, split)
         
         if not os.path.exists(split_path):
             print(f"Warning: Split directory not found: {split_path}")
             continue
         
-        # Process each category
-        for category in ['normal', 'benign', 'malignant']:
-            category_path = os.path.join(split_path, category)
-            if not os.path.exists(category_path):
-                continue
-            
-            # Get all overlay images in this category
-            for img_file in os.listdir(category_path):
-                if not img_file.endswith('.png'):
-                    continue
-                
-                # Extract image number
-                img_number = extract_image_number(img_file)
-                if img_number is None:
-                    print(f"Warning: Could not extract image number from {img_file}")
-                    continue
-                
-                # Get corresponding metadata from original dataset
-                # Note: image numbers in the dataset are 1-based, while DataFrame index is 0-based
-                if img_number <= len(original_df):
-                    metadata = original_df.iloc[img_number - 1].to_dict()
-                    metadata['image_filename'] = img_file
-                    metadata['category'] = category
-                    metadata['split'] = split
-                    split_data.append(metadata)
-                else:
-                    print(f"Warning: Image number {img_number} not found in original dataset")
+        # Create DataFrame for this split; the CSV keeps its original columns
+        split_df = metadata_df[metadata_df['split'] == split]
+        if fmt == 'csv':
+            split_df = split_df.drop(columns='image_number')
         
-        # Create DataFrame for this split
-        split_df = pd.DataFrame(split_data)
-        
-        # Save to CSV
+        # Save the split's metadata
         output_path = os.path.join(output_dir, f'{split}_metadata.csv')
-        split_df.to_csv(output_path, index=False)
+        with PROFILER.timer('csv_write'):
+            write_table(split_df, output_path, fmt, SPLIT_METADATA_SCHEMA)
         
         print(f"\n{split.upper()} Split Summary:")
         print(f"Total images: {len(split_df)}")
@@ -76,7 +94,7 @@ def correlate_metadata(partitioned_dir, original_csv_path, output_dir):
         print("\nFetal health distribution:")
         print(split_df['fetal_health'].value_counts())
 
-def main():
+def main(fmt='csv', profile_report=None):
     # Define paths
     partitioned_dir = "data/Ultrasound Fetus Dataset/PartitionedElipseOverlays"
     original_csv = "data/Ultrasound Fetus Dataset/FetusDataset.csv"
@@ -91,13 +109,22 @@ def main():
         return
     
     print("Starting metadata correlation...")
-    correlate_metadata(partitioned_dir, original_csv, output_dir)
+    with PROFILER.timer('correlate_metadata.stage'):
+        correlate_metadata(partitioned_dir, original_csv, output_dir, fmt)
     
     print("\nCorrelation complete!")
     print(f"Metadata files have been saved to: {output_dir}")
     print("\nFiles created:")
     for split in ['train', 'val', 'test']:
-        print(f"- {split}_metadata.csv")
+        print(f"- {split}_metadata{EXTENSIONS[fmt]}")
+    
+    if profile_report:
+        PROFILER.write_report(profile_report)
+        print(f"Profile report saved to: {profile_report}")
+
+def cli(argv=None, prog=None):
+    args = correlate_parser(prog).parse_args(argv)
+    main(fmt=args.format, profile_report=args.profile_report)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    cli()
@@ -1,44 +1,185 @@
 import os
-import kagglehub
+import json
 import shutil
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from materialize import materialize_file, is_materialized, MODES
+from checkpoint import atomic_output, file_hash
 
-# Set up Kaggle credentials
-kaggle_credentials_path = "/Users/danieldamico/Downloads/kaggle.json"
-kaggle_dir = os.path.expanduser("~/.kaggle")
+# Kaggle credentials to install into ~/.kaggle before downloading
+KAGGLE_CREDENTIALS = "/Users/danieldamico/Downloads/kaggle.json"
+KAGGLE_DATASET = "orvile/ultrasound-fetus-dataset"
 
-# Create .kaggle directory if it doesn't exist
-os.makedirs(kaggle_dir, exist_ok=True)
+# Integrity manifest of everything ingested into the data directory:
+#   {relative destination path: {'source': {'size', 'mtime_ns'},
+#                                'size', 'mtime_ns', 'sha256', 'mode', 'requested'}}
+# 'mode' is how the file was placed and 'requested' the mode asked for;
+# they differ when a link fell back to copying.
+# The sha256 was computed from the file as it landed in the data directory,
+# so later stages can trust it while the size and mtime still match.
+INGEST_MANIFEST_NAME = ".ingest_manifest.json"
 
-# Copy credentials file to .kaggle directory
-shutil.copy2(kaggle_credentials_path, os.path.join(kaggle_dir, "kaggle.json"))
+data_dir = "data/Ultrasound Fetus Dataset"
+csv_file = "data/ultrasound_fetus.csv"
 
-# Set proper permissions for the credentials file
-os.chmod(os.path.join(kaggle_dir, "kaggle.json"), 0o600)
+def install_credentials(credentials_path=KAGGLE_CREDENTIALS):
+    """Copy the Kaggle credentials into ~/.kaggle with the permissions kagglehub expects."""
+    kaggle_dir = os.path.expanduser("~/.kaggle")
+    os.makedirs(kaggle_dir, exist_ok=True)
+    target = os.path.join(kaggle_dir, "kaggle.json")
+    if not os.path.exists(credentials_path):
+        if os.path.exists(target):
+            return
+        raise FileNotFoundError(f"Kaggle credentials not found at {credentials_path}")
+    shutil.copy2(credentials_path, target)
+    os.chmod(target, 0o600)
 
-# Download the dataset
-print("Downloading dataset...")
-path = kagglehub.dataset_download("orvile/ultrasound-fetus-dataset")
-print("Path to dataset files:", path)
+def download(credentials_path=KAGGLE_CREDENTIALS):
+    """Download the dataset into the kagglehub cache, returning its path."""
+    import kagglehub
+    install_credentials(credentials_path)
+    print("Downloading dataset...")
+    path = kagglehub.dataset_download(KAGGLE_DATASET)
+    print("Path to dataset files:", path)
+    return path
 
-# Create a data directory in the current project
-project_data_dir = "data"
-os.makedirs(project_data_dir, exist_ok=True)
+def list_source_files(source, destination):
+    """Pair every file under source (a file or a directory) with its destination path."""
+    if os.path.isfile(source):
+        return [(source, destination)]
+    pairs = []
+    for dirpath, dirnames, filenames in os.walk(source):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            src = os.path.join(dirpath, filename)
+            pairs.append((src, os.path.join(destination, os.path.relpath(src, source))))
+    return pairs
 
-# Copy the dataset to the project directory
-source_dir = os.path.join(path, "Ultrasound Fetus Dataset")
-source_csv = os.path.join(path, "ultrasound_fetus.csv")
+def load_ingest_manifest(dest_root):
+    try:
+        with open(os.path.join(dest_root, INGEST_MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
 
-# Copy the dataset directory
-if os.path.exists(source_dir):
-    shutil.copytree(source_dir, os.path.join(project_data_dir, "Ultrasound Fetus Dataset"), dirs_exist_ok=True)
-    print(f"Copied dataset directory to {os.path.join(project_data_dir, 'Ultrasound Fetus Dataset')}")
+def is_ingested(entry, src, src_stat, dst, mode='copy', verify=False):
+    """
+    Check whether a manifest entry shows dst as an up-to-date placement of
+    src in the given mode: placed for that mode (a link that fell back to
+    copying counts) and still placed that way (materialize.is_materialized).
+    """
+    if not entry or entry['source'] != {'size': src_stat.st_size, 'mtime_ns': src_stat.st_mtime_ns}:
+        return False
+    if entry.get('requested', entry['mode']) != mode or not is_materialized(src, dst, mode):
+        return False
+    try:
+        st = os.stat(dst)
+    except OSError:
+        return False
+    if st.st_size != entry['size'] or st.st_mtime_ns != entry['mtime_ns']:
+        return False
+    return not verify or file_hash(dst) == entry['sha256']
 
-# Copy the CSV file
-if os.path.exists(source_csv):
-    shutil.copy2(source_csv, os.path.join(project_data_dir, "ultrasound_fetus.csv"))
-    print(f"Copied CSV file to {os.path.join(project_data_dir, 'ultrasound_fetus.csv')}")
+def ingest_file(src, dst, src_stat, mode='copy'):
+    """Place src at dst and return its manifest entry."""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    used = materialize_file(src, dst, mode)
+    st = os.stat(dst)
+    return {
+        'source': {'size': src_stat.st_size, 'mtime_ns': src_stat.st_mtime_ns},
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'sha256': file_hash(dst),
+        'mode': used,
+        'requested': mode
+    }
 
-print(f"\nDataset is now available in the '{project_data_dir}' directory of your project")
+def ingest(sources, dest_root, mode='copy', threads=8, verify=False, force=False):
+    """
+    Bring dest_root up to date with the given sources.
 
-data_dir = "data/Ultrasound Fetus Dataset"
-csv_file = "data/ultrasound_fetus.csv" 
\ No newline at end of file
+    Args:
+        sources: List of (source path, destination path) pairs; a source may
+            be a file or a directory, destinations are under dest_root
+        dest_root: Data directory holding the ingest manifest
+        mode: How files are placed: 'copy', 'hardlink', 'reflink' or 'symlink'
+            (see materialize.py); links fall back to copying where unsupported
+        threads: Number of files placed and hashed concurrently
+        verify: Re-hash files that look up to date and re-ingest mismatches
+        force: Re-ingest every file
+
+    Files whose source size/mtime and destination size/mtime match the
+    manifest, and that were placed with the same mode, are skipped. Returns (files placed, files already up to date).
+    """
+    if mode not in MODES or mode == 'manifest':
+        raise ValueError(f"Cannot ingest files with mode: {mode}")
+    os.makedirs(dest_root, exist_ok=True)
+    old_manifest = {} if force else load_ingest_manifest(dest_root)
+    manifest = {}
+
+    def place(pair):
+        src, dst = pair
+        key = os.path.relpath(dst, dest_root)
+        src_stat = os.stat(src)
+        entry = old_manifest.get(key)
+        if is_ingested(entry, src, src_stat, dst, mode, verify):
+            return key, entry, False
+        return key, ingest_file(src, dst, src_stat, mode), True
+
+    pairs = [pair for source, destination in sources for pair in list_source_files(source, destination)]
+    placed = 0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for key, entry, changed in executor.map(place, pairs):
+            manifest[key] = entry
+            placed += changed
+
+    with atomic_output(os.path.join(dest_root, INGEST_MANIFEST_NAME)) as tmp_path:
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+    return placed, len(pairs) - placed
+
+def main(source=None, project_data_dir="data", mode='copy', threads=8, verify=False, force=False,
+         credentials_path=KAGGLE_CREDENTIALS):
+    # Download the dataset, unless a local copy of the kagglehub cache is given
+    path = source if source is not None else download(credentials_path)
+
+    # Copy (or link) the dataset directory and the CSV file into the project
+    sources = []
+    source_dir = os.path.join(path, "Ultrasound Fetus Dataset")
+    source_csv = os.path.join(path, "ultrasound_fetus.csv")
+    if os.path.exists(source_dir):
+        sources.append((source_dir, os.path.join(project_data_dir, "Ultrasound Fetus Dataset")))
+    if os.path.exists(source_csv):
+        sources.append((source_csv, os.path.join(project_data_dir, "ultrasound_fetus.csv")))
+    if not sources:
+        print(f"Error: No dataset files found in {path}")
+        return
+
+    placed, up_to_date = ingest(sources, project_data_dir, mode, threads, verify, force)
+    print(f"Ingested {placed} files ({mode}), {up_to_date} already up to date")
+    print(f"Integrity manifest saved to: {os.path.join(project_data_dir, INGEST_MANIFEST_NAME)}")
+    print(f"\nDataset is now available in the '{project_data_dir}' directory of your project")
+
+def cli(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Download the dataset and ingest it into the data directory.")
+    parser.add_argument("--source", default=None,
+                        help="Ingest from this local directory instead of downloading with kagglehub")
+    parser.add_argument("--data-dir", default="data",
+                        help="Project data directory (default: data)")
+    parser.add_argument("--mode", choices=[m for m in MODES if m != 'manifest'], default='copy',
+                        help="How files are placed: copy (default), hardlink, reflink or symlink")
+    parser.add_argument("--threads", type=int, default=8,
+                        help="Files placed and hashed concurrently (default: 8)")
+    parser.add_argument("--verify", action="store_true",
+                        help="Re-hash files that look up to date and re-ingest any that changed")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-ingest every file, ignoring the manifest")
+    parser.add_argument("--credentials", default=KAGGLE_CREDENTIALS,
+                        help="Kaggle credentials file to install before downloading")
+    args = parser.parse_args(argv)
+    main(source=args.source, project_data_dir=args.data_dir, mode=args.mode, threads=args.threads,
+         verify=args.verify, force=args.force, credentials_path=args.credentials)
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,143 @@
+import cv2
+import numpy as np
+from collections import namedtuple
+from profiling import PROFILER
+
+# Result of fitting an ellipse to a binary mask in a single contour pass.
+#   ellipse:      ((center_x, center_y), (axis_1, axis_2), angle) from cv2.fitEllipse,
+#                 or None if there is no contour or it has fewer than 5 points
+#   contour:      the largest external contour, or None if the mask is empty
+#   contour_area: area of the largest contour
+#   perimeter:    closed arc length of the largest contour
+#   circularity:  4*pi*area / perimeter^2 (0 for a degenerate contour)
+#   mask:         the binary mask the contour was found in
+EllipseFit = namedtuple('EllipseFit', ['ellipse', 'contour', 'contour_area', 'perimeter', 'circularity', 'mask'])
+
+def fit_mask_ellipse(binary):
+    """Find the largest contour in a binary mask and fit an ellipse to it."""
+    with PROFILER.timer('findContours'):
+        contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    if not contours:
+        return EllipseFit(None, None, 0.0, 0.0, 0, binary)
+
+    # Find the largest contour, computing each area only once
+    areas = [cv2.contourArea(c) for c in contours]
+    index = int(np.argmax(areas))
+    largest_contour = contours[index]
+    area = areas[index]
+    perimeter = cv2.arcLength(largest_contour, True)
+    circularity = 4 * np.pi * area / (perimeter * perimeter) if perimeter > 0 else 0
+
+    # Fit ellipse to the contour
+    ellipse = None
+    if len(largest_contour) >= 5:  # Need at least 5 points to fit an ellipse
+        with PROFILER.timer('fitEllipse'):
+            ellipse = cv2.fitEllipse(largest_contour)
+
+    return EllipseFit(ellipse, largest_contour, area, perimeter, circularity, binary)
+
+# A moment fit is only trusted when the mask looks like one clean filled
+# ellipse: enough pixels, not touching the frame, and a pixel count within
+# FILL_RATIO_RANGE of the area of the fitted ellipse (multiple blobs, rings
+# and ragged shapes all land well outside it).
+MIN_MOMENT_PIXELS = 50
+FILL_RATIO_RANGE = (0.95, 1.05)
+
+# On masks that pass those checks the moment fit agrees with cv2.fitEllipse
+# on the largest contour to within these tolerances (the contour runs through
+# the centers of the outermost pixels, so its axes come out slightly shorter).
+# Angles are only compared when the ellipse is clearly non-circular.
+MOMENT_FIT_TOLERANCE = {
+    'center_px': 0.5,
+    'axis_px': 1.5,
+    'axis_rel': 0.02,
+    'angle_deg': 2.0
+}
+
+def _mask_moments(mask, threshold, step=4):
+    """
+    Raw moments (m00, m10, m01, m20, m02, m11) of the pixels above threshold
+    and whether any of them touch the frame, or None if there are none.
+
+    Only the mask's bounding box is thresholded: it is found from the row
+    sums of every step-th row (anything shorter than step rows is missed and
+    left to the contour fit) and then the column sums of that band.
+    """
+    height, width = mask.shape
+    rows = np.flatnonzero(cv2.reduce(mask[::step], 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S))
+    if not len(rows):
+        return None
+    y0 = max(rows[0] * step - step + 1, 0)
+    y1 = min(rows[-1] * step + step, height)
+    band = mask[y0:y1]
+    cols = np.flatnonzero(cv2.reduce(band, 0, cv2.REDUCE_SUM, dtype=cv2.CV_32S))
+    x0, x1 = cols[0], cols[-1] + 1
+
+    _, roi = cv2.threshold(band[:, x0:x1], threshold, 1, cv2.THRESH_BINARY)
+    row_sums = cv2.reduce(roi, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel().astype(np.float64)
+    col_sums = cv2.reduce(roi, 0, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel().astype(np.float64)
+    xs = np.arange(x0, x1, dtype=np.float64)
+    ys = np.arange(y0, y1, dtype=np.float64)
+    x_weighted = (roi.astype(np.float32) @ xs.astype(np.float32)).ravel().astype(np.float64)
+    touches_border = ((y0 == 0 and row_sums[0] > 0) or (y1 == height and row_sums[-1] > 0)
+                      or (x0 == 0 and col_sums[0] > 0) or (x1 == width and col_sums[-1] > 0))
+    return (row_sums.sum(), col_sums @ xs, row_sums @ ys, col_sums @ (xs * xs), row_sums @ (ys * ys),
+            x_weighted @ ys, touches_border)
+
+def fit_ellipses_from_moments(masks, threshold=127):
+    """
+    Fit ellipses to annotation masks using image moments instead of contours.
+
+    The moments are computed mask by mask from projections of its bounding
+    box (see _mask_moments); only the ellipse math runs on all of them at
+    once.
+
+    Args:
+        masks: Sequence (or stack) of 2-D uint8 masks
+        threshold: Pixels above this value belong to the annotation
+
+    Returns:
+        (ellipses, moment_fit): a list with a cv2.fitEllipse-style
+        ((center_x, center_y), (minor_axis, major_axis), angle) tuple or None
+        per mask, and a boolean array marking the masks fit from moments.
+        Masks that fail the single-blob checks fall back to the contour fit.
+    """
+    with PROFILER.timer('moments'):
+        moments = np.zeros((len(masks), 7))
+        for i, mask in enumerate(masks):
+            mask_moments = _mask_moments(mask, threshold)
+            if mask_moments is not None:
+                moments[i] = mask_moments
+    m00, m10, m01, m20, m02, m11, touches_border = moments.T
+    touches_border = touches_border > 0
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cx = m10 / m00
+        cy = m01 / m00
+        mu20 = m20 / m00 - cx * cx
+        mu02 = m02 / m00 - cy * cy
+        mu11 = m11 / m00 - cx * cy
+
+        # Eigenvalues of the covariance give the axes: var = (axis / 4)^2 for a filled ellipse
+        common = np.sqrt((mu20 - mu02) ** 2 + 4 * mu11 * mu11)
+        major = 4 * np.sqrt(np.maximum((mu20 + mu02 + common) / 2, 0))
+        minor = 4 * np.sqrt(np.maximum((mu20 + mu02 - common) / 2, 0))
+        theta = np.degrees(0.5 * np.arctan2(2 * mu11, mu20 - mu02))
+        fill_ratio = m00 / (np.pi / 4 * major * minor)
+
+    # cv2.fitEllipse reports (minor, major) with the angle of the minor axis
+    angle = np.mod(theta + 90, 180)
+
+    moment_fit = ((m00 >= MIN_MOMENT_PIXELS) & ~touches_border & (minor > 0)
+                  & (fill_ratio >= FILL_RATIO_RANGE[0]) & (fill_ratio <= FILL_RATIO_RANGE[1]))
+
+    ellipses = []
+    for i in range(len(masks)):
+        if moment_fit[i]:
+            ellipses.append(((float(cx[i]), float(cy[i])), (float(minor[i]), float(major[i])), float(angle[i])))
+        else:
+            # Fall back to the contour fit for multi-blob or degenerate masks
+            _, thresh = cv2.threshold(masks[i], threshold, 255, cv2.THRESH_BINARY)
+            ellipses.append(fit_mask_ellipse(thresh).ellipse)
+    return ellipses, moment_fit
@@ -0,0 +1,131 @@
+import os
+import cv2
+import numpy as np
+import pandas as pd
+from columnar import load_table
+from image_io import read_image
+from partition_dataset import SPLITS
+from arguments import export_parser
+
+# Integer label for each category, stored in {split}_labels.npy
+CATEGORY_LABELS = {
+    'normal': 0,
+    'benign': 1,
+    'malignant': 2
+}
+
+def find_metadata_table(metadata_dir, split):
+    """Find the split's metadata table written by correlate_metadata, in any format."""
+    for ext in ('.arrow', '.parquet', '.csv'):
+        path = os.path.join(metadata_dir, f'{split}_metadata{ext}')
+        if os.path.exists(path):
+            return path
+    return None
+
+def export_split(partitioned_dir, metadata_path, output_dir, split, height=224, width=224):
+    """
+    Pack one split into contiguous memory-mappable arrays.
+
+    Writes {split}_images.npy (uint8, N x height x width x 3, BGR),
+    {split}_labels.npy (int64 category labels) and {split}_metadata.csv, whose
+    row i describes sample i.
+
+    Returns the number of images packed.
+    """
+    metadata = load_table(metadata_path)
+    metadata['image_filename'] = metadata['image_filename'].astype(str)
+    metadata['category'] = metadata['category'].astype(str)
+
+    # Keep only the rows whose image exists so the arrays can be sized up front
+    paths = [os.path.join(partitioned_dir, split, category, filename)
+             for category, filename in zip(metadata['category'], metadata['image_filename'])]
+    exists = np.array([os.path.exists(p) for p in paths], dtype=bool)
+    for p in np.array(paths, dtype=object)[~exists]:
+        print(f"Warning: Image not found: {p}")
+    metadata = metadata[exists].reset_index(drop=True)
+    paths = [p for p, e in zip(paths, exists) if e]
+
+    images = np.lib.format.open_memmap(
+        os.path.join(output_dir, f'{split}_images.npy'), mode='w+',
+        dtype=np.uint8, shape=(len(paths), height, width, 3))
+    for i, path in enumerate(paths):
+        image = read_image(path)
+        if image is None:
+            raise ValueError(f"Could not read image: {path}")
+        if image.shape[:2] != (height, width):
+            image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        images[i] = image
+    images.flush()
+    del images
+
+    labels = metadata['category'].map(CATEGORY_LABELS).to_numpy(dtype=np.int64)
+    np.save(os.path.join(output_dir, f'{split}_labels.npy'), labels)
+    metadata.to_csv(os.path.join(output_dir, f'{split}_metadata.csv'), index_label='index')
+    return len(paths)
+
+def export_dataset(partitioned_dir, metadata_dir, output_dir, height=224, width=224):
+    """
+    Pack every split of the partitioned dataset for fast training input.
+
+    Args:
+        partitioned_dir: Directory containing the partitioned overlays
+        metadata_dir: Directory containing correlate_metadata's split tables
+        output_dir: Directory to save the packed arrays
+        height: Height every image is resized to
+        width: Width every image is resized to
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    counts = {}
+    for split in SPLITS:
+        metadata_path = find_metadata_table(metadata_dir, split)
+        if metadata_path is None:
+            print(f"Warning: Metadata for split not found: {split}")
+            continue
+        counts[split] = export_split(partitioned_dir, metadata_path, output_dir, split, height, width)
+        print(f"Packed {split}: {counts[split]} images")
+    return counts
+
+class PackedSplit:
+    """
+    Random access to a split written by export_dataset.
+
+    The images are memory-mapped, so split[i] is a slice of the mapped file
+    with no decoding; it returns (image, label).
+    """
+
+    def __init__(self, export_dir, split):
+        self.images = np.load(os.path.join(export_dir, f'{split}_images.npy'), mmap_mode='r')
+        self.labels = np.load(os.path.join(export_dir, f'{split}_labels.npy'), mmap_mode='r')
+        self.metadata = pd.read_csv(os.path.join(export_dir, f'{split}_metadata.csv'), index_col='index')
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, i):
+        return self.images[i], self.labels[i]
+
+def main(height=224, width=224):
+    # Define paths
+    partitioned_dir = "data/Ultrasound Fetus Dataset/PartitionedElipseOverlays"
+    metadata_dir = "data/Ultrasound Fetus Dataset/PartitionedMetadata"
+    output_dir = "data/Ultrasound Fetus Dataset/Packed"
+
+    if not os.path.exists(partitioned_dir):
+        print(f"Error: Partitioned directory not found at {partitioned_dir}")
+        return
+
+    print(f"Packing splits at {width}x{height}...")
+    counts = export_dataset(partitioned_dir, metadata_dir, output_dir, height, width)
+
+    print("\nExport complete!")
+    print(f"Packed arrays have been saved to: {output_dir}")
+    for split, count in counts.items():
+        print(f"- {split}: {count} images")
+
+def cli(argv=None, prog=None):
+    args = export_parser(prog).parse_args(argv)
+    main(height=args.height, width=args.width)
+
+if __name__ == "__main__":
+    cli()
@@ -1,133 +1,451 @@
 import os
+import csv
+import time
+import heapq
 import cv2
 import numpy as np
 import pandas as pd
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from ellipse_fit import fit_mask_ellipse
+from columnar import TableWriter, ELLIPSE_SCHEMA
+from image_io import read_image, write_image
+from profiling import PROFILER
+from catalog import default_catalog
+from checkpoint import Journal, atomic_output
+from sharding import in_shard, shard_path, shard_paths
+from online_stats import GroupedStats, RunningStats
+from arguments import extract_parser
 
-def detect_mask_ellipse(image):
-    # Convert to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+# Default binarize parameters (see parameter_sweep.py for tuning them)
+THRESHOLD_PARAMS = {'block_size': 11, 'C': 2, 'kernel_size': 3}
+
+def binarize(gray, block_size=THRESHOLD_PARAMS['block_size'], C=THRESHOLD_PARAMS['C'],
+             kernel_size=THRESHOLD_PARAMS['kernel_size']):
+    """
+    Threshold a grayscale overlayed image into a cleaned-up binary mask.
     
+    block_size (odd) and C are the adaptiveThreshold neighbourhood size and
+    the constant subtracted from its mean; kernel_size is the side of the
+    square kernel of the closing and opening that clean up the mask.
+    """
     # Apply adaptive thresholding to better detect the mask
-    binary = cv2.adaptiveThreshold(
-        gray,
-        255,
-        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-        cv2.THRESH_BINARY_INV,
-        11,  # Block size
-        2    # Constant subtracted from mean
-    )
+    with PROFILER.timer('adaptiveThreshold'):
+        binary = cv2.adaptiveThreshold(
+            gray,
+            255,
+            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY_INV,
+            block_size,
+            C
+        )
     
     # Apply morphological operations to clean up the mask
-    kernel = np.ones((3,3), np.uint8)
-    binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
-    binary = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel)
+    kernel = np.ones((kernel_size, kernel_size), np.uint8)
+    with PROFILER.timer('morphologyEx'):
+        binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
+        binary = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel)
+    return binary
+
+# A pixel belongs to the overlay drawing when its green channel exceeds both
+# blue and red by this much (the ultrasound itself is gray, so they're equal)
+OVERLAY_GREEN_MARGIN = 32
+
+def overlay_bounding_rect(image):
+    """
+    Bounding box (x, y, w, h) of the green overlay drawn on a BGR image, or
+    None if there is none (or the image is not color).
+    """
+    if image.ndim != 3 or image.shape[2] != 3:
+        return None
+    with PROFILER.timer('overlay_mask'):
+        green = cv2.subtract(image[:, :, 1], cv2.max(image[:, :, 0], image[:, :, 2]))
+        _, mask = cv2.threshold(green, OVERLAY_GREEN_MARGIN, 255, cv2.THRESH_BINARY)
+        points = cv2.findNonZero(mask)
+    if points is None or len(points) < 5:
+        return None
+    return cv2.boundingRect(points)
+
+def to_gray(image):
+    """Convert a BGR image to grayscale."""
+    with PROFILER.timer('cvtColor'):
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+def downscale(image, scale):
+    """
+    Shrink an image by scale with INTER_AREA, as a chain of exact halvings
+    where possible (OpenCV has a much faster path for those).
+    """
+    while scale >= 2 and scale % 2 == 0:
+        image = cv2.resize(image, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+        scale /= 2
+    if scale > 1:
+        image = cv2.resize(image, None, fx=1 / scale, fy=1 / scale, interpolation=cv2.INTER_AREA)
+    return image
+
+def detect_mask_ellipse(image, coarse_scale=None, roi_padding=0.15, **threshold_params):
+    """
+    Detect the mask ellipse in an overlayed image, returning an EllipseFit.
     
-    # Find contours
-    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    threshold_params (block_size, C, kernel_size) are passed on to binarize.
     
-    if not contours:
-        return None, binary
+    With coarse_scale (e.g. 4) the green overlay drawing is first located on
+    a copy of the image downsampled by that factor, and the ellipse is then
+    detected at full resolution only inside its bounding box padded by
+    roi_padding of its size. The largest contour of the coarse frame is not
+    used as the candidate, since on speckled frames that is usually noise
+    spanning the whole frame. Falls back to the full-resolution search if
+    no overlay is found at the coarse scale.
+    """
+    if coarse_scale is None or coarse_scale <= 1:
+        # Fit an ellipse to the largest contour, keeping its area and perimeter
+        return fit_mask_ellipse(binarize(to_gray(image), **threshold_params))
     
-    # Find the largest contour
-    largest_contour = max(contours, key=cv2.contourArea)
+    # Locate the overlay at the coarse scale
+    with PROFILER.timer('resize'):
+        small = downscale(image, coarse_scale)
+    candidate = overlay_bounding_rect(small)
+    if candidate is None:
+        return fit_mask_ellipse(binarize(to_gray(image), **threshold_params))
     
-    # Fit ellipse to the contour
-    if len(largest_contour) >= 5:  # Need at least 5 points to fit an ellipse
-        ellipse = cv2.fitEllipse(largest_contour)
-        return ellipse, binary
-    return None, binary
+    # Padded region of interest around the candidate, in full-resolution pixels
+    x, y, w, h = candidate
+    pad = roi_padding * max(w, h) + 1
+    height, width = image.shape[:2]
+    x0 = max(int((x - pad) * coarse_scale), 0)
+    y0 = max(int((y - pad) * coarse_scale), 0)
+    x1 = min(int((x + w + pad) * coarse_scale) + 1, width)
+    y1 = min(int((y + h + pad) * coarse_scale) + 1, height)
+    
+    # Refine at full resolution inside the region only, cropping before the
+    # grayscale conversion
+    roi = fit_mask_ellipse(binarize(to_gray(image[y0:y1, x0:x1]), **threshold_params))
+    if (x0, y0, x1, y1) == (0, 0, width, height):
+        return roi
+    mask = np.zeros((height, width), dtype=roi.mask.dtype)
+    mask[y0:y1, x0:x1] = roi.mask
+    if roi.ellipse is None:
+        return roi._replace(mask=mask)
+    
+    # Shift the results back into full-image coordinates
+    (cx, cy), axes, angle = roi.ellipse
+    return roi._replace(
+        ellipse=((cx + x0, cy + y0), axes, angle),
+        contour=roi.contour + np.array([x0, y0], dtype=roi.contour.dtype),
+        mask=mask
+    )
+
+def list_images(category_path, catalog=None):
+    """List the image files in a category directory."""
+    return (catalog or default_catalog()).listdir(category_path, ('.png', '.jpg', '.jpeg'))
 
-def analyze_category(category_path, category_name):
-    results = []
-    image_files = [f for f in os.listdir(category_path) if f.endswith(('.png', '.jpg', '.jpeg'))]
+def analyze_image(category_path, img_file, category_name, debug_codec='png', coarse_scale=None, validate_coarse=False):
+    """Detect the ellipse in a single image and save its verification images.
     
-    for img_file in image_files:
-        img_path = os.path.join(category_path, img_file)
-        image = cv2.imread(img_path)
-        
-        if image is None:
-            print(f"Could not read image: {img_path}")
-            continue
+    The verification images in mask_analysis/ are written with debug_codec
+    (see image_io.CODECS), or not at all if it is 'skip'.
+    
+    coarse_scale enables the coarse-to-fine detection of detect_mask_ellipse.
+    With validate_coarse the full-resolution fit is also run and the
+    differences are added to the result as delta_* columns.
+    
+    Returns the result row for the image, or None if no ellipse was found.
+    """
+    with PROFILER.timer('extract_ellipse_params.image'):
+        return _analyze_image(category_path, img_file, category_name, debug_codec, coarse_scale, validate_coarse)
+
+def _analyze_image(category_path, img_file, category_name, debug_codec, coarse_scale, validate_coarse):
+    img_path = os.path.join(category_path, img_file)
+    image = read_image(img_path)
+    
+    if image is None:
+        print(f"Could not read image: {img_path}")
+        return None
+    
+    # Detect ellipse from mask
+    fit = detect_mask_ellipse(image, coarse_scale)
+    ellipse, binary_mask = fit.ellipse, fit.mask
+    
+    if ellipse is None:
+        return None
+    
+    center, axes, angle = ellipse
+    major_axis = max(axes)
+    minor_axis = min(axes)
+    
+    result = {
+        'image': img_file,
+        'category': category_name,
+        'center_x': center[0],
+        'center_y': center[1],
+        'major_axis': major_axis,
+        'minor_axis': minor_axis,
+        'angle': angle,
+        'aspect_ratio': major_axis / minor_axis if minor_axis > 0 else 0.0,
+        'contour_area': fit.contour_area,
+        'contour_perimeter': fit.perimeter,
+        'circularity': fit.circularity
+    }
+    
+    if coarse_scale and validate_coarse:
+        result.update(coarse_fit_deltas(fit.ellipse, detect_mask_ellipse(image).ellipse))
+    
+    if debug_codec == 'skip':
+        return result
+    
+    # Save the binary mask for verification
+    output_dir = f"mask_analysis/{category_name}"
+    os.makedirs(output_dir, exist_ok=True)
+    write_image(os.path.join(output_dir, f"mask_{img_file}"), binary_mask, debug_codec)
+    
+    # Draw the detected ellipse on the original image
+    result_image = image.copy()
+    cv2.ellipse(result_image, ellipse, (0, 255, 0), 2)
+    write_image(os.path.join(output_dir, f"ellipse_{img_file}"), result_image, debug_codec)
+    
+    return result
+
+def coarse_fit_deltas(coarse, full):
+    """Differences between a coarse-to-fine ellipse and the full-resolution one."""
+    if full is None:
+        return {'delta_center': np.nan, 'delta_major_axis': np.nan, 'delta_minor_axis': np.nan, 'delta_angle': np.nan}
+    (cx, cy), axes, angle = coarse
+    (fx, fy), full_axes, full_angle = full
+    return {
+        'delta_center': float(np.hypot(cx - fx, cy - fy)),
+        'delta_major_axis': max(axes) - max(full_axes),
+        'delta_minor_axis': min(axes) - min(full_axes),
+        'delta_angle': abs((angle - full_angle + 90) % 180 - 90)
+    }
+
+def _analyze_image_task(task):
+    """
+    Unpack a (category_path, img_file, category_name, options) task for the process pool.
+    
+    The profiler samples collected for the image are returned with its
+    result so they reach the parent process.
+    """
+    category_path, img_file, category_name, options = task
+    return analyze_image(category_path, img_file, category_name, **options), PROFILER.drain()
+
+def iter_category_results(category_path, category_name, executor=None, chunksize=16, journal=None, completed=None,
+                          shard=None, **options):
+    """
+    Analyze every image in a category directory, yielding each result row as
+    soon as it is available.
+    
+    Args:
+        category_path: Directory containing the category's images
+        category_name: Name of the category (normal, benign, malignant)
+        executor: Optional ProcessPoolExecutor to fan the images out over.
+            Results are yielded in directory listing order either way, so
+            the output is identical to a serial run.
+        chunksize: Number of images submitted to a worker per task
+        journal: Optional checkpoint.Journal each image's result is appended
+            to as soon as it is available
+        completed: Optional {img_file: result} of images already analyzed
+            by an interrupted run; these are not analyzed again
+        shard: Optional (index, count) to only analyze the images of one
+            shard (see sharding.in_shard)
+        options: Passed on to analyze_image (debug_codec, coarse_scale,
+            validate_coarse)
+    """
+    completed = completed or {}
+    images = [img_file for img_file in list_images(category_path) if in_shard(img_file, shard)]
+    tasks = [(category_path, img_file, category_name, options) for img_file in images if img_file not in completed]
+    
+    if executor is None:
+        # Samples are recorded straight into this process's PROFILER, there is nothing to ship
+        outputs = ((analyze_image(path, img_file, name, **opts), {}) for path, img_file, name, opts in tasks)
+    else:
+        outputs = executor.map(_analyze_image_task, tasks, chunksize=chunksize)
+    outputs = zip(tasks, outputs)
+    
+    for img_file in images:
+        if img_file in completed:
+            result = completed[img_file]
+        else:
+            task, (result, samples) = next(outputs)
+            PROFILER.merge(samples)
+            if journal is not None:
+                journal.append({'category': category_name, 'image': img_file, 'result': result})
+        if result is not None:
+            yield result
+
+def analyze_category(category_path, category_name, executor=None, chunksize=16, **kwargs):
+    """Analyze every image in a category directory, returning the result rows (see iter_category_results)."""
+    return list(iter_category_results(category_path, category_name, executor, chunksize, **kwargs))
+
+def load_checkpoint(journal, config):
+    """
+    Check a resumed journal against this run's options and collect its results.
+    
+    Returns {category: {img_file: result}}. A fresh journal gets config
+    written as its first record.
+    """
+    if not journal.records:
+        journal.append({'config': config})
+        return {}
+    if journal.records[0].get('config') != config:
+        raise ValueError(f"{journal.path} was written with different options; rerun without --resume")
+    
+    completed = {}
+    for record in journal.records[1:]:
+        completed.setdefault(record['category'], {})[record['image']] = record['result']
+    return completed
+
+# Per-category statistics saved to ellipse_statistics.csv
+STAT_COLUMNS = ['major_axis', 'minor_axis', 'angle', 'aspect_ratio', 'contour_area', 'circularity']
+STAT_AGGREGATIONS = ['mean', 'std', 'min', 'max']
+
+# Accuracy columns added by --validate-coarse
+DELTA_COLUMNS = ['delta_center', 'delta_major_axis', 'delta_minor_axis', 'delta_angle']
+
+class ResultStatistics:
+    """
+    Per-category statistics of the result rows, accumulated one row at a time.
+    
+    The saved table matches df.groupby('category').agg(...).round(2) over all
+    the rows, without keeping them in memory.
+    """
+    
+    def __init__(self):
+        self.categories = GroupedStats(STAT_COLUMNS, 'category')
+        self.deltas = {column: RunningStats(quantiles=(0.25, 0.5, 0.75)) for column in DELTA_COLUMNS}
+    
+    def update(self, row):
+        self.categories.update(row)
+        for column, stats in self.deltas.items():
+            if column in row:
+                stats.update(abs(row[column]))
+    
+    def save(self, path='ellipse_statistics.csv'):
+        """Save the per-category statistics table and return it."""
+        stats = self.categories.to_frame(STAT_AGGREGATIONS).round(2)
+        with atomic_output(path) as tmp_path:
+            stats.to_csv(tmp_path)
+        return stats
+    
+    def print_summary(self, stats, coarse_scale=None):
+        print("\nEllipse Parameters Summary:")
+        print("\nCategory-wise Statistics:")
+        print(stats)
         
-        # Detect ellipse from mask
-        ellipse, binary_mask = detect_mask_ellipse(image)
+        # Print category counts
+        print("\nNumber of images processed per category:")
+        counts = pd.Series(self.categories.counts, name='count').rename_axis('category')
+        print(counts.sort_values(ascending=False, kind='stable'))
         
-        if ellipse is not None:
-            center, axes, angle = ellipse
-            major_axis = max(axes)
-            minor_axis = min(axes)
-            
-            # Calculate contour area and perimeter
-            contours, _ = cv2.findContours(binary_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            largest_contour = max(contours, key=cv2.contourArea)
-            area = cv2.contourArea(largest_contour)
-            perimeter = cv2.arcLength(largest_contour, True)
-            
-            results.append({
-                'image': img_file,
-                'category': category_name,
-                'center_x': center[0],
-                'center_y': center[1],
-                'major_axis': major_axis,
-                'minor_axis': minor_axis,
-                'angle': angle,
-                'aspect_ratio': major_axis / minor_axis if minor_axis > 0 else 0,
-                'contour_area': area,
-                'contour_perimeter': perimeter,
-                'circularity': 4 * np.pi * area / (perimeter * perimeter) if perimeter > 0 else 0
-            })
-            
-            # Save the binary mask for verification
-            output_dir = f"mask_analysis/{category_name}"
-            os.makedirs(output_dir, exist_ok=True)
-            cv2.imwrite(os.path.join(output_dir, f"mask_{img_file}"), binary_mask)
-            
-            # Draw the detected ellipse on the original image
-            result_image = image.copy()
-            cv2.ellipse(result_image, ellipse, (0, 255, 0), 2)
-            cv2.imwrite(os.path.join(output_dir, f"ellipse_{img_file}"), result_image)
-    
-    return results
-
-def main():
+        # Print the accuracy of the coarse-to-fine fit against full resolution (quantiles are approximate)
+        if self.deltas['delta_center'].count:
+            print(f"\nCoarse-to-fine (scale {coarse_scale}) vs full-resolution fit:")
+            print(pd.DataFrame({column: running.describe() for column, running in self.deltas.items()}).round(3))
+
+def main(workers=None, chunksize=16, fmt='csv', debug_codec='png', profile_report=None, coarse_scale=None, validate_coarse=False,
+         resume=False, checkpoint_every=64, shard=None):
     base_path = "data/Ultrasound Fetus Dataset/OverlayedImages"
-    all_results = []
+    journal_path = shard_path("ellipse_parameters.journal.jsonl", shard)
+    
+    # Default to one worker per CPU; a single worker runs serially in-process
+    if workers is None:
+        workers = os.cpu_count() or 1
     
     # Create output directory for analysis
     os.makedirs("mask_analysis", exist_ok=True)
     
-    # Process each category
-    for category in ['normal', 'benign', 'malignant']:
-        category_path = os.path.join(base_path, category)
-        results = analyze_category(category_path, category)
-        all_results.extend(results)
-    
-    # Convert to DataFrame
-    df = pd.DataFrame(all_results)
-    
-    # Calculate statistics for each category
-    stats = df.groupby('category').agg({
-        'major_axis': ['mean', 'std', 'min', 'max'],
-        'minor_axis': ['mean', 'std', 'min', 'max'],
-        'angle': ['mean', 'std', 'min', 'max'],
-        'aspect_ratio': ['mean', 'std', 'min', 'max'],
-        'contour_area': ['mean', 'std', 'min', 'max'],
-        'circularity': ['mean', 'std', 'min', 'max']
-    }).round(2)
-    
-    # Save results
-    df.to_csv('ellipse_parameters.csv', index=False)
-    stats.to_csv('ellipse_statistics.csv')
-    
-    # Print summary
-    print("\nEllipse Parameters Summary:")
-    print("\nCategory-wise Statistics:")
-    print(stats)
-    
-    # Print category counts
-    print("\nNumber of images processed per category:")
-    print(df['category'].value_counts())
+    statistics = ResultStatistics()
+    
+    start_time = time.perf_counter()
+    n_images = 0
+    offset = 0
+    # Every analyzed image is journaled, so an interrupted run can be resumed
+    journal = Journal(journal_path, checkpoint_every, resume=resume)
+    options = {'debug_codec': debug_codec, 'coarse_scale': coarse_scale, 'validate_coarse': validate_coarse}
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        completed = load_checkpoint(journal, options)
+        n_resumed = sum(len(images) for images in completed.values())
+        if n_resumed:
+            print(f"Resuming: {n_resumed} images recovered from {journal_path}")
+        
+        # Rows are streamed to the output as they arrive; a shard saves partial
+        # results (with their single-node positions) for --merge-shards
+        if shard is None:
+            output = TableWriter('ellipse_parameters.csv', fmt, ELLIPSE_SCHEMA)
+        else:
+            output = TableWriter(shard_path('ellipse_parameters.csv', shard))
+        
+        # Process each category
+        with output:
+            for category in ['normal', 'benign', 'malignant']:
+                category_path = os.path.join(base_path, category)
+                images = list_images(category_path)
+                positions = {img_file: offset + i for i, img_file in enumerate(images)}
+                with PROFILER.timer('extract_ellipse_params.category'):
+                    for result in iter_category_results(category_path, category, executor, chunksize, journal,
+                                                        completed.get(category), shard, **options):
+                        if shard is None:
+                            output.write(result)
+                            statistics.update(result)
+                        else:
+                            output.write({**result, 'ordinal': positions[result['image']]})
+                offset += len(images)
+                n_images += len(images) if shard is None else sum(in_shard(img_file, shard) for img_file in images)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        journal.close()
+    elapsed = time.perf_counter() - start_time
+    
+    if shard is None:
+        with PROFILER.timer('csv_write'):
+            stats = statistics.save()
+        statistics.print_summary(stats, coarse_scale)
+    else:
+        print(f"\nShard {shard[0]}/{shard[1]}: {output.count} results saved to {output.path}")
+    
+    # Print throughput
+    rate = n_images / elapsed if elapsed > 0 else 0
+    print(f"\nProcessed {n_images} images in {elapsed:.2f}s with {workers} worker(s) ({rate:.1f} images/sec)")
+    
+    if profile_report:
+        PROFILER.write_report(profile_report)
+        print(f"Profile report saved to: {profile_report}")
+
+def read_shard_results(path):
+    """Stream the rows of a partial shard result file, converting the numeric columns back."""
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            yield {column: value if column in ('image', 'category') else float(value) if value else np.nan
+                   for column, value in row.items()}
+
+def merge_shards(n_shards, fmt='csv', coarse_scale=None):
+    """
+    Combine the partial results of n_shards shard runs.
+    
+    Writes the same ellipse_parameters and ellipse_statistics files as a
+    single-node run over the whole dataset. Each shard's rows are already in
+    single-node order, so they are merged as streams.
+    """
+    paths = shard_paths('ellipse_parameters.csv', n_shards)
+    statistics = ResultStatistics()
+    with TableWriter('ellipse_parameters.csv', fmt, ELLIPSE_SCHEMA) as output:
+        for row in heapq.merge(*map(read_shard_results, paths), key=lambda row: row['ordinal']):
+            del row['ordinal']
+            output.write(row)
+            statistics.update(row)
+    print(f"Merged {output.count} results from {n_shards} shards")
+    stats = statistics.save()
+    statistics.print_summary(stats, coarse_scale)
+
+def cli(argv=None, prog=None):
+    args = extract_parser(prog).parse_args(argv)
+    if args.merge_shards:
+        merge_shards(args.merge_shards, fmt=args.format, coarse_scale=args.coarse_scale)
+    else:
+        main(workers=args.workers, chunksize=args.chunksize, fmt=args.format, debug_codec=args.debug_codec,
+             profile_report=args.profile_report, coarse_scale=args.coarse_scale, validate_coarse=args.validate_coarse,
+             resume=args.resume, checkpoint_every=args.checkpoint_every, shard=args.shard)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    cli()
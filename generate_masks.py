@@ -1,119 +1,422 @@
 import cv2
 import numpy as np
 import os
+import json
 import pandas as pd
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from ellipse_fit import fit_mask_ellipse
+from image_io import read_image, write_image, codec_path
+from profiling import PROFILER
+from catalog import default_catalog
+from checkpoint import Journal, atomic_output, file_hash
+from sharding import in_shard, shard_path, shard_paths
+from arguments import masks_parser
 
-def create_ellipse_overlay(image, ellipse_params):
-    """Create an overlay with the ellipse drawn on the original image."""
+# Manifest of overlays already generated, stored in the output directory
+MANIFEST_NAME = ".overlay_manifest.json"
+
+# Manifest entries for overlays written since the manifest was last saved,
+# replayed on the next run if this one didn't finish
+JOURNAL_NAME = ".overlay_manifest.journal.jsonl"
+
+# Everything besides the input images that affects an overlay; bump the
+# version whenever the fitting or rendering code changes
+FIT_PARAMS = {
+    'version': 1,
+    'threshold': 127,
+    'color': [0, 255, 0],
+    'thickness': 2,
+    'alpha': 0.7
+}
+
+def _full_frame_overlay(image, ellipse_params):
+    """Draw the ellipse on a copy of the whole image and blend the whole frame (reference renderer)."""
     overlay = image.copy()
     
     # Draw the ellipse
-    cv2.ellipse(overlay,
-                (int(ellipse_params['center_x']), int(ellipse_params['center_y'])),
-                (int(ellipse_params['axis_x']), int(ellipse_params['axis_y'])),
-                ellipse_params['angle'],
-                0, 360, (0, 255, 0), 2)  # Green color, 2px thickness
+    with PROFILER.timer('ellipse'):
+        cv2.ellipse(overlay,
+                    (int(ellipse_params['center_x']), int(ellipse_params['center_y'])),
+                    (int(ellipse_params['axis_x']), int(ellipse_params['axis_y'])),
+                    ellipse_params['angle'],
+                    0, 360, (0, 255, 0), 2)  # Green color, 2px thickness
     
     # Blend the overlay with the original image
-    result = cv2.addWeighted(overlay, 0.7, image, 0.3, 0)
+    with PROFILER.timer('addWeighted'):
+        result = cv2.addWeighted(overlay, 0.7, image, 0.3, 0)
     return result
 
-def process_annotations(annotation_dir, output_base_path):
-    """Process annotation images and generate overlays."""
+def blend_table(color=FIT_PARAMS['color'], alpha=FIT_PARAMS['alpha']):
+    """
+    Precompute the blended value of every (channel, pixel value) under the ellipse.
+    
+    Built with cv2.addWeighted itself, so table[c, v] is exactly what blending
+    color[c] over v gives. Pixels off the ellipse blend to themselves
+    (alpha*v + (1-alpha)*v rounds back to v), so only ellipse pixels change.
+    """
+    values = np.tile(np.arange(256, dtype=np.uint8), (len(color), 1))
+    drawn = np.repeat(np.array(color, dtype=np.uint8)[:, None], 256, axis=1)
+    return cv2.addWeighted(drawn, alpha, values, round(1 - alpha, 6), 0)
+
+BLEND_TABLE = blend_table()
+# The same table laid out for cv2.LUT on a BGR image: entry v holds the blended (b, g, r)
+BLEND_LUT = np.ascontiguousarray(BLEND_TABLE.T.reshape(256, 1, -1))
+
+def ellipse_mask_roi(ellipse_params, height, width, thickness=FIT_PARAMS['thickness']):
+    """
+    Rasterize the overlay ellipse within its bounding box.
+    
+    Returns (x0, y0, mask) where mask is a uint8 array covering
+    [y0:y0+h, x0:x0+w] of the frame with 255 on the pixels cv2.ellipse draws,
+    or None if the ellipse lies entirely outside the frame.
+    """
+    center_x, center_y = int(ellipse_params['center_x']), int(ellipse_params['center_y'])
+    axis_x, axis_y = int(ellipse_params['axis_x']), int(ellipse_params['axis_y'])
+    angle = ellipse_params['angle']
+    
+    # Half extents of the rotated ellipse (cv2.ellipse rounds the angle to whole
+    # degrees), padded for the line thickness and fixed-point rounding
+    theta = np.radians(round(angle))
+    half_w = np.hypot(axis_x * np.cos(theta), axis_y * np.sin(theta))
+    half_h = np.hypot(axis_x * np.sin(theta), axis_y * np.cos(theta))
+    pad = thickness + 2
+    x0 = max(int(np.floor(center_x - half_w)) - pad, 0)
+    y0 = max(int(np.floor(center_y - half_h)) - pad, 0)
+    x1 = min(int(np.ceil(center_x + half_w)) + pad + 1, width)
+    y1 = min(int(np.ceil(center_y + half_h)) + pad + 1, height)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    
+    # Drawing with the center shifted by whole pixels shifts the raster exactly
+    mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    cv2.ellipse(mask, (center_x - x0, center_y - y0), (axis_x, axis_y), angle, 0, 360, 255, thickness)
+    return x0, y0, mask
+
+def create_ellipse_overlay(image, ellipse_params, inplace=False):
+    """
+    Create an overlay with the ellipse drawn on the original image.
+    
+    Pixel-identical to drawing on a full copy and blending the whole frame
+    with cv2.addWeighted, but only the ellipse's bounding box is rasterized
+    and only the pixels under the ellipse are blended, through BLEND_LUT.
+    With inplace=True the image itself is modified and returned, avoiding
+    the copy entirely.
+    """
+    if image.ndim != 3 or image.shape[2] != BLEND_TABLE.shape[0]:
+        return _full_frame_overlay(image, ellipse_params)
+    
+    overlay = image if inplace else image.copy()
+    _blend_ellipse(overlay, ellipse_params)
+    return overlay
+
+def _blend_ellipse(image, ellipse_params):
+    """Blend the overlay ellipse into a BGR image in place, touching only its bounding box."""
+    with PROFILER.timer('ellipse'):
+        roi = ellipse_mask_roi(ellipse_params, *image.shape[:2])
+    if roi is None:
+        return
+    
+    x0, y0, mask = roi
+    with PROFILER.timer('blend'):
+        region = image[y0:y0 + mask.shape[0], x0:x0 + mask.shape[1]]
+        cv2.copyTo(cv2.LUT(region, BLEND_LUT), mask, region)
+
+def create_ellipse_overlays(images, ellipse_params_list, inplace=False):
+    """
+    Render the overlays of a batch of same-size images.
+    
+    images is a (batch, height, width, 3) uint8 array. The batch is copied
+    once (unless inplace=True) and each ellipse is then blended into its
+    frame's bounding box. The result is identical to calling
+    create_ellipse_overlay on each image.
+    """
+    overlays = images if inplace else images.copy()
+    for overlay, ellipse_params in zip(overlays, ellipse_params_list):
+        _blend_ellipse(overlay, ellipse_params)
+    return overlays
+
+def overlay_ellipse_params(ellipse):
+    """Convert a cv2.fitEllipse result into the parameters used by create_ellipse_overlay."""
+    (center_x, center_y), (axis_x, axis_y), angle = ellipse
+    return {
+        'center_x': center_x,
+        'center_y': center_y,
+        'axis_x': axis_x/2,  # OpenCV returns full length, divide by 2 for radius
+        'axis_y': axis_y/2,
+        'angle': angle
+    }
+
+def fit_annotation_ellipse(annotation, threshold=FIT_PARAMS['threshold']):
+    """Threshold an annotation mask to binary and fit its ellipse, returning an EllipseFit."""
+    with PROFILER.timer('threshold'):
+        _, thresh = cv2.threshold(annotation, threshold, 255, cv2.THRESH_BINARY)
+    
+    # Fit ellipse to the largest contour
+    return fit_mask_ellipse(thresh)
+
+def load_manifest(manifest_path):
+    """Load the overlay manifest, returning an empty one if missing or unreadable."""
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+def save_manifest(manifest_path, manifest):
+    """Atomically write the overlay manifest."""
+    with atomic_output(manifest_path) as tmp_path:
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+
+def source_fingerprint(path, previous=None):
+    """
+    Fingerprint a source image by content hash.
+    
+    The hash from a previous fingerprint is reused when the file's size and
+    mtime are unchanged, so unchanged files are not re-read.
+    """
+    st = os.stat(path)
+    if previous and previous.get('size') == st.st_size and previous.get('mtime_ns') == st.st_mtime_ns:
+        return previous
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': file_hash(path)}
+
+def overlay_is_current(entry, annotation, original, overlay_path, params=FIT_PARAMS):
+    """Check whether a manifest entry still describes an up-to-date overlay."""
+    if not entry or entry.get('params') != params:
+        return False
+    if entry['annotation']['sha256'] != annotation['sha256'] or entry['original']['sha256'] != original['sha256']:
+        return False
+    try:
+        st = os.stat(overlay_path)
+    except OSError:
+        return False
+    return st.st_size == entry['overlay']['size'] and st.st_mtime_ns == entry['overlay']['mtime_ns']
+
+def read_image_pair(annotation_path, original_path):
+    """Read an annotation (grayscale) and its original image, through the image cache."""
+    return read_image(annotation_path, cv2.IMREAD_GRAYSCALE), read_image(original_path)
+
+def write_overlay(overlay_path, overlay, codec='png'):
+    """Write an overlay image, returning its size and mtime for the manifest."""
+    overlay_path = write_image(overlay_path, overlay, codec)
+    st = os.stat(overlay_path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+def process_annotations(annotation_dir, output_base_path, force=False, read_ahead=8, write_queue=8, io_threads=4, codec='png', catalog=None, checkpoint_every=64,
+                        shard=None):
+    """
+    Process annotation images and generate overlays.
+    
+    Overlays whose annotation, original image and fit parameters are unchanged
+    since the last run (according to the manifest in output_base_path) are
+    skipped unless force is set.
+    
+    Image reads and overlay writes run on background thread pools so the
+    fitting and rendering overlap with I/O: up to read_ahead image pairs are
+    prefetched and up to write_queue overlays are left to finish writing,
+    each pool using io_threads threads.
+    
+    Overlays are encoded with codec (see image_io.CODECS; 'skip' is not
+    allowed since the overlays are this stage's output).
+    
+    Annotations are found through the dataset catalog (catalog.py) rather
+    than by listing the directories.
+    
+    Each overlay is journaled as soon as it is written (fsynced every
+    checkpoint_every overlays), so if the run is killed the next one picks
+    up where it stopped instead of regenerating everything.
+    
+    With shard=(index, count) only that shard's annotations are processed
+    (see sharding.in_shard), recording them in a per-shard manifest that
+    merge_shard_manifests later combines. Shards can run concurrently on
+    several machines sharing the output directory.
+    """
+    if codec == 'skip':
+        raise ValueError("Overlays can't be written with the 'skip' codec")
+    params = {**FIT_PARAMS, 'codec': codec}
+    catalog = catalog or default_catalog()
+    
     # Create output directory
     os.makedirs(output_base_path, exist_ok=True)
     
+    # Load the manifest of previously generated overlays
+    manifest_path = shard_path(Path(output_base_path) / MANIFEST_NAME, shard)
+    old_manifest = {} if force else load_manifest(manifest_path)
+    if shard is not None and not force:
+        old_manifest = {**load_manifest(Path(output_base_path) / MANIFEST_NAME), **old_manifest}
+    manifest = {}
+    
+    # Replay the overlays written by an interrupted run
+    journal = Journal(shard_path(Path(output_base_path) / JOURNAL_NAME, shard), checkpoint_every, resume=not force)
+    for record in journal.records:
+        old_manifest[record['key']] = record['entry']
+    if journal.records:
+        print(f"Resuming: {len(journal.records)} overlays recovered from the journal")
+    
     # Initialize counters
     total_processed = 0
     category_counts = {}
+    cache_hits = 0
+    cache_misses = 0
     
-    # Process each category
-    for category in os.listdir(annotation_dir):
-        category_path = Path(annotation_dir) / category
-        if not category_path.is_dir():
-            continue
-            
-        # Create category output directory
-        category_output = Path(output_base_path) / category
-        os.makedirs(category_output, exist_ok=True)
-        
-        print(f"\nProcessing {category} category...")
-        category_processed = 0
-        
-        # Process each annotation image
-        for fname in os.listdir(category_path):
-            if not fname.endswith("_Annotation.png"):
-                continue
+    reader = ThreadPoolExecutor(max_workers=io_threads)
+    writer = ThreadPoolExecutor(max_workers=io_threads)
+    writes = deque()
+    
+    def finish_writes(limit):
+        # Wait for the oldest writes until at most limit are still pending
+        while len(writes) > limit:
+            task, future = writes.popleft()
+            manifest[task['key']] = {
+                'annotation': task['annotation_fp'],
+                'original': task['original_fp'],
+                'params': params,
+                'overlay': future.result()
+            }
+            journal.append({'key': task['key'], 'entry': manifest[task['key']]})
+    
+    try:
+        # Process each category
+        for category in catalog.subdirs(annotation_dir):
+            category_path = Path(annotation_dir) / category
                 
-            # Read annotation image
-            img_path = category_path / fname
-            img = cv2.imread(str(img_path), cv2.IMREAD_GRAYSCALE)
-            
-            if img is None:
-                print(f"Could not read image: {img_path}")
-                continue
+            # Create category output directory
+            category_output = Path(output_base_path) / category
+            os.makedirs(category_output, exist_ok=True)
             
-            # Threshold to binary
-            _, thresh = cv2.threshold(img, 127, 255, cv2.THRESH_BINARY)
+            print(f"\nProcessing {category} category...")
+            category_processed = 0
             
-            # Find contours
-            contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            if len(contours) == 0:
-                print(f"No contours found in: {fname}")
-                continue
-            
-            # Fit ellipse to the largest contour
-            cnt = max(contours, key=cv2.contourArea)
-            
-            if len(cnt) < 5:
-                print(f"Not enough points to fit ellipse in: {fname}")
-                continue
-            
-            # Fit ellipse
-            ellipse = cv2.fitEllipse(cnt)
-            (center_x, center_y), (axis_x, axis_y), angle = ellipse
-            
-            # Get the original image
-            original_img = fname.replace("_Annotation.png", ".png")
-            original_path = category_path / original_img
-            
-            if not original_path.exists():
-                print(f"Original image not found: {original_path}")
-                continue
-            
-            # Read original image
-            original = cv2.imread(str(original_path))
-            if original is None:
-                print(f"Could not read original image: {original_path}")
-                continue
+            # Find the annotations whose overlays need regenerating
+            pending = []
+            filenames = catalog.listdir(category_path)
+            available = set(filenames)
+            for fname in filenames:
+                if not fname.endswith("_Annotation.png") or not in_shard(fname, shard):
+                    continue
+                    
+                img_path = category_path / fname
+                original_img = fname.replace("_Annotation.png", ".png")
+                original_path = category_path / original_img
+                overlay_path = codec_path(category_output / f"overlay_{original_img}", codec)
+                
+                if original_img not in available:
+                    print(f"Original image not found: {original_path}")
+                    continue
+                
+                # Skip the image if its overlay is already up to date
+                key = f"{category}/{fname}"
+                entry = old_manifest.get(key)
+                annotation_fp = source_fingerprint(img_path, entry and entry['annotation'])
+                original_fp = source_fingerprint(original_path, entry and entry['original'])
+                if overlay_is_current(entry, annotation_fp, original_fp, overlay_path, params):
+                    manifest[key] = entry
+                    cache_hits += 1
+                    category_processed += 1
+                    total_processed += 1
+                    continue
+                cache_misses += 1
+                
+                pending.append({
+                    'fname': fname,
+                    'key': key,
+                    'img_path': img_path,
+                    'original_path': original_path,
+                    'overlay_path': overlay_path,
+                    'annotation_fp': annotation_fp,
+                    'original_fp': original_fp
+                })
             
-            # Create overlay
-            ellipse_params = {
-                'center_x': center_x,
-                'center_y': center_y,
-                'axis_x': axis_x/2,  # OpenCV returns full length, divide by 2 for radius
-                'axis_y': axis_y/2,
-                'angle': angle
-            }
+            # Prefetch image pairs ahead of the fitting
+            tasks = iter(pending)
+            reads = deque()
             
-            overlay = create_ellipse_overlay(original, ellipse_params)
+            def prefetch():
+                while len(reads) < max(read_ahead, 1):
+                    task = next(tasks, None)
+                    if task is None:
+                        return
+                    reads.append((task, reader.submit(read_image_pair, task['img_path'], task['original_path'])))
             
-            # Save overlay
-            overlay_path = category_output / f"overlay_{original_img}"
-            cv2.imwrite(str(overlay_path), overlay)
+            prefetch()
+            while reads:
+                task, future = reads.popleft()
+                prefetch()
+                fname = task['fname']
+                with PROFILER.timer('generate_masks.read_wait'):
+                    img, original = future.result()
+                
+                if img is None:
+                    print(f"Could not read image: {task['img_path']}")
+                    continue
+                
+                # Threshold to binary and fit ellipse to the largest contour
+                fit = fit_annotation_ellipse(img)
+                
+                if fit.contour is None:
+                    print(f"No contours found in: {fname}")
+                    continue
+                
+                if fit.ellipse is None:
+                    print(f"Not enough points to fit ellipse in: {fname}")
+                    continue
+                
+                if original is None:
+                    print(f"Could not read original image: {task['original_path']}")
+                    continue
+                
+                # Create overlay (on a copy, the original is shared through the image cache)
+                ellipse_params = overlay_ellipse_params(fit.ellipse)
+                overlay = create_ellipse_overlay(original, ellipse_params)
+                
+                # Save overlay in the background, recording it in the manifest once written
+                writes.append((task, writer.submit(write_overlay, task['overlay_path'], overlay, codec)))
+                with PROFILER.timer('generate_masks.write_wait'):
+                    finish_writes(write_queue)
+                
+                category_processed += 1
+                total_processed += 1
+                print(f"Processed: {fname}")
             
-            category_processed += 1
-            total_processed += 1
-            print(f"Processed: {fname}")
+            category_counts[category] = category_processed
+            print(f"Completed {category}: {category_processed} images processed")
         
-        category_counts[category] = category_processed
-        print(f"Completed {category}: {category_processed} images processed")
+        finish_writes(0)
+    finally:
+        reader.shutdown()
+        writer.shutdown()
+        journal.close()
+    
+    # Save the manifest for the next run; the journal is then redundant
+    with PROFILER.timer('manifest_write'):
+        save_manifest(manifest_path, manifest)
+    os.remove(journal.path)
+    print(f"\nOverlay cache: {cache_hits} up to date, {cache_misses} regenerated")
     
     return total_processed, category_counts
 
-def main():
+def merge_shard_manifests(output_base_path, n_shards):
+    """
+    Combine the manifests of n_shards finished shard runs into the overlay manifest.
+    
+    Afterwards a single-node run sees every shard's overlays as up to date.
+    Returns the number of overlays in the merged manifest.
+    """
+    manifest_path = Path(output_base_path) / MANIFEST_NAME
+    paths = shard_paths(manifest_path, n_shards)
+    manifest = {}
+    for path in paths:
+        manifest.update(load_manifest(path))
+    save_manifest(manifest_path, manifest)
+    for path in paths:
+        os.remove(path)
+    return len(manifest)
+
+def main(force=False, read_ahead=8, write_queue=8, io_threads=4, codec='png', profile_report=None, checkpoint_every=64,
+         shard=None, merge_shards=None):
     # Base paths
     annotation_dir = "data/Ultrasound Fetus Dataset/matched_dataset"
     output_base = "data/Ultrasound Fetus Dataset/Overlays"
@@ -122,8 +425,17 @@ def main():
         print(f"Error: Annotation directory not found at {annotation_dir}")
         return
     
+    if merge_shards:
+        n_overlays = merge_shard_manifests(output_base, merge_shards)
+        print(f"Merged {merge_shards} shard manifests: {n_overlays} overlays in {output_base}")
+        return
+    
     print("Starting overlay generation...")
-    total_processed, category_counts = process_annotations(annotation_dir, output_base)
+    with PROFILER.timer('generate_masks.stage'):
+        total_processed, category_counts = process_annotations(
+            annotation_dir, output_base, force=force,
+            read_ahead=read_ahead, write_queue=write_queue, io_threads=io_threads, codec=codec,
+            checkpoint_every=checkpoint_every, shard=shard)
     
     print("\nOverlay generation complete!")
     print(f"Total images processed: {total_processed}")
@@ -131,6 +443,16 @@ def main():
     for category, count in category_counts.items():
         print(f"{category}: {count} images")
     print(f"\nOverlays have been saved to: {output_base}")
+    
+    if profile_report:
+        PROFILER.write_report(profile_report)
+        print(f"Profile report saved to: {profile_report}")
+
+def cli(argv=None, prog=None):
+    args = masks_parser(prog).parse_args(argv)
+    main(force=args.force, read_ahead=args.read_ahead, write_queue=args.write_queue,
+         io_threads=args.io_threads, codec=args.codec, profile_report=args.profile_report,
+         checkpoint_every=args.checkpoint_every, shard=args.shard, merge_shards=args.merge_shards)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    cli()
@@ -0,0 +1,153 @@
+import os
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from profiling import PROFILER
+from arguments import CODECS
+
+# Extensions of every image file the pipeline can write
+IMAGE_EXTENSIONS = ('.png', '.webp', '.npy')
+
+# Byte budget of the decoded-image cache shared by every stage in a process
+IMAGE_CACHE_BYTES = int(os.environ.get('MHF_IMAGE_CACHE_BYTES', 512 * 1024 * 1024))
+
+def parse_codec(codec):
+    """Split a codec string into its name and compression level (or None)."""
+    name, _, level = codec.partition(':')
+    if name not in ('png', 'webp', 'npy', 'skip') or (level and (name != 'png' or not level.isdigit() or int(level) > 9)):
+        raise ValueError(f"Unknown image codec: {codec}")
+    return name, int(level) if level else None
+
+def codec_path(path, codec):
+    """Swap the extension of path for the one written by codec."""
+    name, _ = parse_codec(codec)
+    return os.path.splitext(str(path))[0] + ('.png' if name == 'skip' else f'.{name}')
+
+def write_image(path, image, codec='png'):
+    """
+    Write an image with the given codec, replacing the extension of path to match.
+
+    Returns the path written, or None if the codec is 'skip'.
+    """
+    name, level = parse_codec(codec)
+    if name == 'skip':
+        return None
+
+    path = codec_path(path, codec)
+    with PROFILER.timer('imwrite'):
+        if name == 'npy':
+            np.save(path, image)
+        elif name == 'webp':
+            # Quality above 100 selects lossless WebP
+            cv2.imwrite(path, image, [cv2.IMWRITE_WEBP_QUALITY, 101])
+        elif level is not None:
+            cv2.imwrite(path, image, [cv2.IMWRITE_PNG_COMPRESSION, level])
+        else:
+            cv2.imwrite(path, image)
+    return path
+
+class ImageCache:
+    """
+    Size-bounded LRU cache of decoded images, keyed by path and read flags.
+
+    Entries remember the file's size and mtime when it was decoded, so a
+    file rewritten since is decoded again rather than served stale. Cached
+    arrays are marked read-only because every reader shares them; copy one
+    before modifying it. Images larger than the whole budget are never
+    cached, and a budget of 0 disables caching.
+
+    hits, misses and evictions count lookups since the last clear().
+    Safe to use from several threads.
+    """
+
+    def __init__(self, max_bytes=IMAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path, flags, load):
+        """Return the image at path decoded with flags, calling load(path, flags) on a miss."""
+        key = (os.path.abspath(path), flags)
+        try:
+            st = os.stat(key[0])
+            version = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            version = None
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        image = load(path, flags)
+        if image is None or version is None or image.nbytes > self.max_bytes:
+            return image
+        image.flags.writeable = False
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1].nbytes
+            self.entries[key] = (version, image)
+            self.nbytes += image.nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+        return image
+
+    def resize(self, max_bytes):
+        """Change the byte budget, evicting the least recently used images to fit."""
+        with self.lock:
+            self.max_bytes = max_bytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every cached image and reset the counters."""
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'images': len(self.entries), 'bytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+IMAGE_CACHE = ImageCache()
+
+def _decode_image(path, flags):
+    with PROFILER.timer('imread'):
+        if not str(path).endswith('.npy'):
+            return cv2.imread(str(path), flags)
+        try:
+            image = np.load(path)
+        except (OSError, ValueError):
+            return None
+    if flags == cv2.IMREAD_GRAYSCALE and image.ndim == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
+
+def read_image(path, flags=cv2.IMREAD_COLOR, cache=True):
+    """
+    Read an image written by write_image (including .npy arrays), or None if unreadable.
+
+    Decoded images go through IMAGE_CACHE, so reading the same file again
+    (from this or another stage in the same process) costs a stat. The
+    returned array is read-only when it came from the cache; with
+    cache=False the file is always decoded into a fresh, writable array.
+    """
+    if not cache:
+        return _decode_image(path, flags)
+    return IMAGE_CACHE.get(str(path), flags, _decode_image)
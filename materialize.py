@@ -0,0 +1,132 @@
+import os
+import errno
+import shutil
+from profiling import PROFILER
+
+# Supported ways of placing a source file into a derived dataset tree:
+#   copy     - full copy (shutil.copy2)
+#   hardlink - hard link to the source, falls back to copy across devices
+#   reflink  - copy-on-write clone where the filesystem supports it, else copy
+#   symlink  - symbolic link to the absolute source path
+#   manifest - write no files, only record membership in a manifest CSV
+MODES = ('copy', 'hardlink', 'reflink', 'symlink', 'manifest')
+
+# ioctl request number for FICLONE on Linux (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+# Errors meaning "this filesystem/device can't link or clone, copy instead"
+FALLBACK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EMLINK}
+
+def reflink(src, dst):
+    """Clone src to dst with a copy-on-write reflink (Linux only)."""
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+    shutil.copystat(src, dst)
+
+def materialize_file(src, dst, mode='copy'):
+    """
+    Place src at dst using the given materialization mode.
+
+    Hardlinks and reflinks fall back to a regular copy when the filesystem
+    doesn't support them or src and dst are on different devices.
+
+    Returns the mode that was actually used.
+    """
+    if mode not in MODES or mode == 'manifest':
+        raise ValueError(f"Cannot materialize a file with mode: {mode}")
+
+    # Clear out any previous output first: links can't overwrite, and copying
+    # onto a link to src would write through it (or fail as the same file)
+    if os.path.lexists(dst):
+        os.unlink(dst)
+
+    if mode == 'copy':
+        shutil.copy2(src, dst)
+        return 'copy'
+
+    try:
+        if mode == 'hardlink':
+            os.link(src, dst)
+        elif mode == 'reflink':
+            reflink(src, dst)
+        else:
+            os.symlink(os.path.abspath(src), dst)
+    except (OSError, ImportError) as e:
+        if isinstance(e, OSError) and e.errno not in FALLBACK_ERRNOS:
+            raise
+        shutil.copy2(src, dst)
+        return 'copy'
+    return mode
+
+def is_materialized(src, dst, mode='copy'):
+    """
+    Check whether dst already holds src the way the given mode places it:
+    a symlink to src, a hard link to src (or a copy, where the two are on
+    different devices and the link would have fallen back), or for copy and
+    reflink a separate file with the same size and mtime (both preserve
+    the source's mtime).
+    """
+    try:
+        src_stat = os.stat(src)
+        dst_stat = os.lstat(dst)
+    except OSError:
+        return False
+    if mode == 'symlink':
+        return os.path.islink(dst) and os.readlink(dst) == os.path.abspath(src)
+    if os.path.islink(dst):
+        return False
+    same_file = (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino)
+    if mode == 'hardlink' and (same_file or src_stat.st_dev == dst_stat.st_dev):
+        return same_file
+    return (not same_file and src_stat.st_size == dst_stat.st_size
+            and src_stat.st_mtime_ns == dst_stat.st_mtime_ns)
+
+class Materializer:
+    """
+    Materialize files into a dataset tree and record what went where.
+
+    With incremental=True, destinations that already hold their source in
+    the requested mode (see is_materialized) are left alone and counted as
+    'unchanged'.
+    """
+
+    def __init__(self, mode='copy', incremental=False):
+        if mode not in MODES:
+            raise ValueError(f"Unknown materialization mode: {mode} (expected one of {', '.join(MODES)})")
+        self.mode = mode
+        self.incremental = incremental
+        self.records = []
+        self.counts = {}
+
+    @property
+    def writes_files(self):
+        return self.mode != 'manifest'
+
+    def place(self, src, dst, **fields):
+        """Materialize src at dst, recording any extra fields alongside the paths."""
+        self.records.append({**fields, 'source': str(src), 'destination': str(dst)})
+        if not self.writes_files:
+            return
+        if self.incremental and is_materialized(src, dst, self.mode):
+            used = 'unchanged'
+        else:
+            with PROFILER.timer('materialize'):
+                used = materialize_file(src, dst, self.mode)
+        self.counts[used] = self.counts.get(used, 0) + 1
+
+    def write_manifest(self, path):
+        """Save the recorded placements as a CSV index."""
+        import pandas as pd
+        pd.DataFrame(self.records).to_csv(path, index=False)
+
+    def summary(self):
+        """Describe how the files were materialized."""
+        if not self.writes_files:
+            return f"{len(self.records)} files recorded in manifest (no files written)"
+        return ", ".join(f"{count} {mode}" for mode, count in sorted(self.counts.items())) or "no files written"
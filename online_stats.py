@@ -0,0 +1,159 @@
+import math
+import bisect
+import pandas as pd
+
+class P2Quantile:
+    """
+    Streaming estimate of a single quantile with the P-square algorithm
+    (Jain & Chlamtac, 1985), using five markers and constant memory.
+
+    Exact until five values have been seen.
+    """
+
+    def __init__(self, q):
+        self.q = q
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5]
+        self.increments = [0, q / 2, q, (1 + q) / 2, 1]
+
+    def update(self, value):
+        h = self.heights
+        if len(h) < 5:
+            bisect.insort(h, value)
+            return
+
+        # Find the cell the value falls in, extending the extremes if needed
+        if value < h[0]:
+            h[0] = value
+            k = 0
+        elif value >= h[4]:
+            h[4] = value
+            k = 3
+        else:
+            k = bisect.bisect_right(h, value) - 1
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards their desired positions
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = h[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1]))
+                if not h[i - 1] < height < h[i + 1]:
+                    # Parabolic prediction left the cell, fall back to linear
+                    height = h[i] + d * (h[i + d] - h[i]) / (n[i + d] - n[i])
+                h[i] = height
+                n[i] += d
+
+    @property
+    def value(self):
+        h = self.heights
+        if not h:
+            return math.nan
+        if len(h) < 5:
+            # Linear interpolation, like pandas' quantile
+            pos = self.q * (len(h) - 1)
+            lower = int(pos)
+            upper = min(lower + 1, len(h) - 1)
+            return h[lower] + (h[upper] - h[lower]) * (pos - lower)
+        return h[2]
+
+class RunningStats:
+    """
+    Count, mean, sample standard deviation, min and max of a stream of
+    values, plus optional approximate quantiles.
+
+    Computed the way pandas' groupby aggregations are, so results agree to
+    the last bit rather than just approximately: the mean from a Kahan
+    compensated sum, the variance with Welford's algorithm. Missing
+    (None/NaN) values are skipped, as pandas does.
+    """
+
+    def __init__(self, quantiles=()):
+        self.count = 0
+        self.total = 0.0
+        self.compensation = 0.0
+        self.running_mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.quantiles = {q: P2Quantile(q) for q in quantiles}
+
+    def update(self, value):
+        if value is None or math.isnan(value):
+            return
+        self.count += 1
+        y = value - self.compensation
+        t = self.total + y
+        self.compensation = t - self.total - y
+        self.total = t
+        previous_mean = self.running_mean
+        self.running_mean += (value - previous_mean) / self.count
+        self.m2 += (value - self.running_mean) * (value - previous_mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        for estimator in self.quantiles.values():
+            estimator.update(value)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else math.nan
+
+    @property
+    def std(self):
+        """Sample standard deviation (ddof=1), NaN with fewer than two values."""
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else math.nan
+
+    def get(self, aggregation):
+        """Look up an aggregate by its pandas name ('mean', 'std', 'min', 'max', 'count')."""
+        if aggregation == 'count':
+            return self.count
+        if self.count == 0:
+            return math.nan
+        return {'mean': self.mean, 'std': self.std, 'min': self.min, 'max': self.max}[aggregation]
+
+    def describe(self):
+        """Summary like pandas' Series.describe(), with approximate quantiles."""
+        summary = {name: self.get(name) for name in ('count', 'mean', 'std', 'min')}
+        summary.update({f"{q * 100:g}%": estimator.value for q, estimator in sorted(self.quantiles.items())})
+        summary['max'] = self.get('max')
+        return summary
+
+class GroupedStats:
+    """
+    RunningStats for several columns per group, updated one row at a time.
+
+    to_frame() gives the same table as
+    df.groupby(key).agg({column: aggregations for column in columns}).
+    """
+
+    def __init__(self, columns, key, quantiles=()):
+        self.columns = list(columns)
+        self.key = key
+        self.quantiles = quantiles
+        self.groups = {}
+        self.counts = {}
+
+    def update(self, row):
+        group = row[self.key]
+        stats = self.groups.get(group)
+        if stats is None:
+            stats = self.groups[group] = {column: RunningStats(self.quantiles) for column in self.columns}
+            self.counts[group] = 0
+        self.counts[group] += 1
+        for column in self.columns:
+            stats[column].update(row[column])
+
+    def to_frame(self, aggregations=('mean', 'std', 'min', 'max')):
+        groups = sorted(self.groups)
+        columns = pd.MultiIndex.from_product([self.columns, list(aggregations)])
+        data = [[self.groups[group][column].get(aggregation) for column, aggregation in columns] for group in groups]
+        return pd.DataFrame(data, index=pd.Index(groups, name=self.key), columns=columns, dtype=float)
@@ -1,20 +1,11 @@
 import os
+import numpy as np
 import pandas as pd
-import shutil
 from pathlib import Path
-import re
-
-# Define paths
-base_path = Path('data/Ultrasound Fetus Dataset')
-csv_path = base_path / 'FetusDataset.csv'
-datasets_path = base_path / 'Datasets'
-output_path = base_path / 'Data/matched_dataset'
-
-# Create output directory if it doesn't exist
-output_path.mkdir(parents=True, exist_ok=True)
-
-# Read the CSV file
-df = pd.read_csv(csv_path)
+from materialize import Materializer
+from columnar import write_table, MATCHED_SCHEMA
+from catalog import default_catalog
+from arguments import organize_parser
 
 # Map fetal health classes to categories
 # 1.0 = Normal
@@ -26,109 +17,159 @@ health_to_category = {
     3.0: 'malignant'
 }
 
-# Create a mapping of image numbers to their categories
-image_mapping = {}
-
-# Process each category directory
-for category in ['normal', 'benign', 'malignant']:
-    category_path = datasets_path / category
-    if category_path.exists():
-        for img_file in category_path.glob('*.png'):
-            try:
-                # Skip annotation files
-                if '_Annotation' in img_file.name:
-                    continue
-                    
-                # Extract the number from the filename using regex
-                match = re.match(r'(\d+)_', img_file.name)
-                if match:
-                    img_number = int(match.group(1))
-                    image_mapping[img_number] = {
-                        'category': category,
-                        'filename': img_file.name,
-                        'has_annotation': (img_file.parent / f"{img_file.stem}_Annotation.png").exists()
-                    }
-            except (ValueError, AttributeError) as e:
-                print(f"Error processing file {img_file.name}: {str(e)}")
+# Columns of matched_data.csv; the metadata columns come from FetusDataset.csv
+# with 'baseline value' renamed to 'baseline_value'
+MATCHED_COLUMNS = [
+    'image_number',
+    'image_filename',
+    'has_annotation',
+    'original_category',
+    'corrected_category',
+    'fetal_health',
+    'baseline_value',
+    'accelerations',
+    'fetal_movement',
+    'uterine_contractions',
+    'light_decelerations',
+    'severe_decelerations',
+    'prolongued_decelerations',
+    'abnormal_short_term_variability',
+    'mean_value_of_short_term_variability',
+    'percentage_of_time_with_abnormal_long_term_variability',
+    'mean_value_of_long_term_variability',
+    'histogram_width',
+    'histogram_min',
+    'histogram_max',
+    'histogram_number_of_peaks',
+    'histogram_number_of_zeroes',
+    'histogram_mode',
+    'histogram_mean',
+    'histogram_median',
+    'histogram_variance',
+    'histogram_tendency'
+]
+
+def build_image_index(datasets_path, catalog=None):
+    """
+    Look up the original images under Datasets/ in the catalog.
+
+    Returns a DataFrame with image_number, image_filename, has_annotation and
+    original_category columns, one row per image number.
+    """
+    catalog = catalog or default_catalog()
+    rows = []
+    for category in ['normal', 'benign', 'malignant']:
+        category_path = datasets_path / category
+        if not category_path.exists():
+            continue
+        entries = catalog.files(category_path, '.png')
+        filenames = {entry['name'] for entry in entries}
+        for entry in entries:
+            # Skip annotation files
+            filename = entry['name']
+            if '_Annotation' in filename or entry['image_number'] is None:
                 continue
 
-# Create a new DataFrame to store the matched data
-matched_data = []
-
-# Iterate through the CSV data
-for idx, row in df.iterrows():
-    # The index + 1 corresponds to the image number
-    img_number = idx + 1
-    
-    if img_number in image_mapping:
-        img_info = image_mapping[img_number]
-        expected_category = health_to_category[row['fetal_health']]
-        actual_category = img_info['category']
-        
-        if expected_category != actual_category:
-            print(f"Warning: Image {img_number} is in {actual_category} directory but has fetal_health class {row['fetal_health']} (should be in {expected_category})")
-        
-        source_img = datasets_path / actual_category / img_info['filename']
-        
-        if source_img.exists():
-            # Create category directory in output if it doesn't exist
-            category_output = output_path / expected_category
-            category_output.mkdir(exist_ok=True)
-            
-            # Copy the image to the output directory
-            dest_img = category_output / source_img.name
-            shutil.copy2(source_img, dest_img)
-            
-            # Copy annotation file if it exists
-            if img_info['has_annotation']:
-                source_annotation = source_img.parent / f"{source_img.stem}_Annotation.png"
-                dest_annotation = category_output / f"{source_img.stem}_Annotation.png"
-                shutil.copy2(source_annotation, dest_annotation)
-            
-            # Add the data to our matched dataset
-            matched_data.append({
-                'image_number': img_number,
-                'image_filename': img_info['filename'],
-                'has_annotation': img_info['has_annotation'],
-                'original_category': actual_category,
-                'corrected_category': expected_category,
-                'fetal_health': row['fetal_health'],
-                'baseline_value': row['baseline value'],
-                'accelerations': row['accelerations'],
-                'fetal_movement': row['fetal_movement'],
-                'uterine_contractions': row['uterine_contractions'],
-                'light_decelerations': row['light_decelerations'],
-                'severe_decelerations': row['severe_decelerations'],
-                'prolongued_decelerations': row['prolongued_decelerations'],
-                'abnormal_short_term_variability': row['abnormal_short_term_variability'],
-                'mean_value_of_short_term_variability': row['mean_value_of_short_term_variability'],
-                'percentage_of_time_with_abnormal_long_term_variability': row['percentage_of_time_with_abnormal_long_term_variability'],
-                'mean_value_of_long_term_variability': row['mean_value_of_long_term_variability'],
-                'histogram_width': row['histogram_width'],
-                'histogram_min': row['histogram_min'],
-                'histogram_max': row['histogram_max'],
-                'histogram_number_of_peaks': row['histogram_number_of_peaks'],
-                'histogram_number_of_zeroes': row['histogram_number_of_zeroes'],
-                'histogram_mode': row['histogram_mode'],
-                'histogram_mean': row['histogram_mean'],
-                'histogram_median': row['histogram_median'],
-                'histogram_variance': row['histogram_variance'],
-                'histogram_tendency': row['histogram_tendency']
+            stem = filename[:-len('.png')]
+            rows.append({
+                'image_number': entry['image_number'],
+                'image_filename': filename,
+                'has_annotation': f"{stem}_Annotation.png" in filenames,
+                'original_category': category
             })
 
-# Create a DataFrame from the matched data
-matched_df = pd.DataFrame(matched_data)
-
-# Save the matched data to a new CSV file
-matched_df.to_csv(output_path / 'matched_data.csv', index=False)
-
-# Print summary statistics
-print(f"\nTotal images processed: {len(matched_data)}")
-print("\nOriginal category distribution:")
-print(matched_df['original_category'].value_counts())
-print("\nCorrected category distribution:")
-print(matched_df['corrected_category'].value_counts())
-print("\nFetal health distribution:")
-print(matched_df['fetal_health'].value_counts())
-print("\nImages with annotations:")
-print(matched_df['has_annotation'].value_counts()) 
\ No newline at end of file
+    index = pd.DataFrame(rows, columns=['image_number', 'image_filename', 'has_annotation', 'original_category'])
+    # An image number found in several directories keeps the last one scanned
+    return index.drop_duplicates('image_number', keep='last')
+
+def organize_dataset(base_path, mode='copy', fmt='csv'):
+    """
+    Match the images in Datasets/ with their metadata rows in FetusDataset.csv.
+
+    Matched images (and their annotations) are placed in Data/matched_dataset
+    under their corrected category, alongside matched_data.csv.
+
+    Args:
+        base_path: Root of the Ultrasound Fetus Dataset
+        mode: How images are placed in the output tree: 'copy', 'hardlink',
+            'reflink', 'symlink', or 'manifest' to write only an index of
+            the placements (matched_manifest.csv) and no image files
+        fmt: Output format for matched_data ('csv', 'parquet' or 'arrow')
+    """
+    base_path = Path(base_path)
+    csv_path = base_path / 'FetusDataset.csv'
+    datasets_path = base_path / 'Datasets'
+    output_path = base_path / 'Data/matched_dataset'
+    materializer = Materializer(mode)
+
+    # Create output directory if it doesn't exist
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    # Read the CSV file
+    df = pd.read_csv(csv_path)
+
+    # Build the filename index in one directory scan
+    image_index = build_image_index(datasets_path)
+
+    # Join the index with the CSV rows; row N (1-based) is image number N
+    metadata = df.rename(columns={'baseline value': 'baseline_value'})
+    metadata.insert(0, 'image_number', np.arange(1, len(metadata) + 1))
+    matched = image_index.merge(metadata, on='image_number', how='inner').sort_values('image_number', kind='stable')
+    matched['corrected_category'] = matched['fetal_health'].map(health_to_category)
+
+    mismatched = matched[matched['corrected_category'] != matched['original_category']]
+    for img_number, actual_category, fetal_health, expected_category in zip(
+            mismatched['image_number'], mismatched['original_category'],
+            mismatched['fetal_health'], mismatched['corrected_category']):
+        print(f"Warning: Image {img_number} is in {actual_category} directory but has fetal_health class {fetal_health} (should be in {expected_category})")
+
+    # Place each image (and its annotation) under its corrected category
+    for filename, has_annotation, actual_category, expected_category, img_number in zip(
+            matched['image_filename'], matched['has_annotation'], matched['original_category'],
+            matched['corrected_category'], matched['image_number']):
+        source_img = datasets_path / actual_category / filename
+
+        # Create category directory in output if it doesn't exist
+        category_output = output_path / expected_category
+        if materializer.writes_files:
+            category_output.mkdir(exist_ok=True)
+
+        # Place the image in the output directory
+        dest_img = category_output / source_img.name
+        materializer.place(source_img, dest_img, image_number=img_number, category=expected_category, role='original')
+
+        # Place annotation file if it exists
+        if has_annotation:
+            source_annotation = source_img.parent / f"{source_img.stem}_Annotation.png"
+            dest_annotation = category_output / f"{source_img.stem}_Annotation.png"
+            materializer.place(source_annotation, dest_annotation, image_number=img_number, category=expected_category, role='annotation')
+
+    # Select the matched data columns
+    matched_df = matched[MATCHED_COLUMNS]
+
+    # Save the matched data to a new CSV file
+    write_table(matched_df, output_path / 'matched_data.csv', fmt, MATCHED_SCHEMA)
+    if not materializer.writes_files:
+        materializer.write_manifest(output_path / 'matched_manifest.csv')
+
+    # Print summary statistics
+    print(f"\nTotal images processed: {len(matched_df)}")
+    print("\nOriginal category distribution:")
+    print(matched_df['original_category'].value_counts())
+    print("\nCorrected category distribution:")
+    print(matched_df['corrected_category'].value_counts())
+    print("\nFetal health distribution:")
+    print(matched_df['fetal_health'].value_counts())
+    print("\nImages with annotations:")
+    print(matched_df['has_annotation'].value_counts())
+    print(f"\nMaterialized images: {materializer.summary()}")
+
+def main(mode='copy', fmt='csv'):
+    organize_dataset(Path('data/Ultrasound Fetus Dataset'), mode=mode, fmt=fmt)
+
+def cli(argv=None, prog=None):
+    args = organize_parser(prog).parse_args(argv)
+    main(mode=args.mode, fmt=args.format)
+
+if __name__ == "__main__":
+    cli()
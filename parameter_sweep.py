@@ -0,0 +1,226 @@
+import os
+import time
+import itertools
+import cv2
+import numpy as np
+import pandas as pd
+from ellipse_fit import fit_mask_ellipse
+from extract_ellipse_params import binarize, coarse_fit_deltas, THRESHOLD_PARAMS
+from generate_masks import fit_annotation_ellipse
+from image_io import read_image
+from catalog import default_catalog
+from columnar import write_table
+from online_stats import RunningStats
+from profiling import PROFILER
+from shm_pool import SharedFramePool
+from arguments import DEFAULT_GRID, sweep_parser
+
+# Per-image accuracy measures, averaged over the images where an ellipse was detected
+# (iou counts missed images as 0, so it also reflects the detection rate)
+SCORE_COLUMNS = ['iou', 'center_error', 'axis_error', 'angle_error']
+
+def parameter_grid(block_sizes=DEFAULT_GRID['block_size'], constants=DEFAULT_GRID['C'],
+                   kernel_sizes=DEFAULT_GRID['kernel_size']):
+    """Every combination of the given binarize parameters, as a list of keyword dicts."""
+    for block_size in block_sizes:
+        if block_size < 3 or block_size % 2 == 0:
+            raise ValueError(f"adaptiveThreshold block size must be odd and at least 3: {block_size}")
+    for kernel_size in kernel_sizes:
+        if kernel_size < 1:
+            raise ValueError(f"Kernel size must be at least 1: {kernel_size}")
+    return [{'block_size': b, 'C': c, 'kernel_size': k}
+            for b, c, k in itertools.product(block_sizes, constants, kernel_sizes)]
+
+def ellipse_iou(detected, truth, shape=None):
+    """
+    Intersection over union of two filled ellipses given as cv2.fitEllipse
+    results.
+
+    Both ellipses are rasterized within the bounding box of the pair, so the
+    intersection and the union are counted from the same pixels. With the
+    (height, width) shape of the frame, the box is clipped to it, so a
+    wildly oversized detection costs no more than a full frame.
+    """
+    points = np.concatenate([cv2.boxPoints(detected), cv2.boxPoints(truth)])
+    x0, y0 = np.floor(points.min(axis=0)).astype(int) - 1
+    x1, y1 = np.ceil(points.max(axis=0)).astype(int) + 1
+    if shape is not None:
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, shape[1]), min(y1, shape[0])
+    if x1 <= x0 or y1 <= y0:
+        return 0.0
+    masks = np.zeros((2, y1 - y0, x1 - x0), dtype=np.uint8)
+    for mask, ((cx, cy), axes, angle) in zip(masks, (detected, truth)):
+        cv2.ellipse(mask, ((cx - x0, cy - y0), axes, angle), 1, -1)
+    union = np.count_nonzero(masks[0] | masks[1])
+    return np.count_nonzero(masks[0] & masks[1]) / union if union else 0.0
+
+def evaluate_frame(gray, grid, truth):
+    """
+    Detect the ellipse in a grayscale overlayed image with every parameter
+    set in grid, scoring each against the ground-truth ellipse.
+
+    Returns one small record per parameter set: the detection time and, if
+    an ellipse was found, its accuracy.
+    """
+    records = []
+    for params in grid:
+        start = time.perf_counter()
+        fit = fit_mask_ellipse(binarize(gray, **params))
+        record = {'seconds': time.perf_counter() - start, 'iou': 0.0}
+        if fit.ellipse is not None:
+            deltas = coarse_fit_deltas(fit.ellipse, truth)
+            record.update({
+                'iou': ellipse_iou(fit.ellipse, truth, gray.shape),
+                'center_error': deltas['delta_center'],
+                'axis_error': (abs(deltas['delta_major_axis']) + abs(deltas['delta_minor_axis'])) / 2,
+                'angle_error': deltas['delta_angle']
+            })
+        records.append(record)
+    return records
+
+def iter_frames(overlay_dir, annotation_dir, limit=None, catalog=None):
+    """
+    Decode and grayscale each overlayed image once, paired with its
+    ground-truth ellipse, yielding the frames one at a time so only those
+    being evaluated are in memory.
+
+    The ground truth is fitted to the image's *_Annotation.png the same way
+    generate_masks fits it for the overlays (fit_annotation_ellipse).
+    Images and annotations are matched by image number through the catalog.
+
+    Yields (image name, grayscale image, ground-truth ellipse), ordered by
+    image number and cut to the first limit images if given.
+    """
+    catalog = catalog or default_catalog()
+    annotations = {entry['image_number']: os.path.join(entry['dir'], entry['name'])
+                   for entry in catalog.query(annotation_dir, role='annotation')
+                   if entry['image_number'] is not None}
+    entries = sorted((entry for entry in catalog.query(overlay_dir)
+                      if entry['role'] in ('original', 'overlay') and entry['image_number'] in annotations),
+                     key=lambda entry: (entry['image_number'], entry['name']))
+
+    for entry in entries[:limit]:
+        annotation_path = annotations[entry['image_number']]
+        annotation = read_image(annotation_path, cv2.IMREAD_GRAYSCALE)
+        truth = fit_annotation_ellipse(annotation).ellipse if annotation is not None else None
+        if truth is None:
+            print(f"No ground-truth ellipse in: {annotation_path}")
+            continue
+
+        img_path = os.path.join(entry['dir'], entry['name'])
+        image = read_image(img_path)
+        if image is None:
+            print(f"Could not read image: {img_path}")
+            continue
+        with PROFILER.timer('cvtColor'):
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        yield entry['name'], gray, truth
+
+def sweep(frames, grid, workers=None):
+    """
+    Evaluate every parameter set in grid on every frame and rank them.
+
+    frames is an iterable of (name, grayscale image, ground-truth ellipse),
+    such as iter_frames, consumed as it goes. Each frame is handed to a
+    worker once (through a shm_pool.SharedFramePool when workers > 1) and
+    scored against the whole grid there, so only the small per-set records
+    travel back. Returns the table from rank_results.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    n_frames = 0
+
+    def tasks():
+        nonlocal n_frames
+        for _, gray, truth in frames:
+            n_frames += 1
+            yield gray, (grid, truth)
+
+    stats = [{column: RunningStats() for column in ['seconds'] + SCORE_COLUMNS} for _ in grid]
+    detected = [0] * len(grid)
+
+    def accumulate(records):
+        for i, record in enumerate(records):
+            detected[i] += 'center_error' in record
+            for column, value in record.items():
+                stats[i][column].update(value)
+
+    if workers > 1:
+        # The ring is sized from the first frame; larger ones are pickled instead
+        with SharedFramePool(workers) as pool:
+            for records in pool.imap('sweep', tasks()):
+                accumulate(records)
+    else:
+        for gray, args in tasks():
+            accumulate(evaluate_frame(gray, *args))
+    return rank_results(grid, stats, detected, n_frames)
+
+def rank_results(grid, stats, detected, n_images):
+    """
+    Table of the parameter sets ranked by mean IoU (best first), ties broken
+    by per-image cost. The number of images evaluated is kept in
+    ranking.attrs['n_images'].
+    """
+    rows = []
+    for params, columns, n_detected in zip(grid, stats, detected):
+        rows.append({
+            **params,
+            'detection_rate': n_detected / n_images if n_images else np.nan,
+            'mean_iou': columns['iou'].mean,
+            'center_error': columns['center_error'].mean,
+            'axis_error': columns['axis_error'].mean,
+            'angle_error': columns['angle_error'].mean,
+            'ms_per_image': columns['seconds'].mean * 1000,
+            'default': params == THRESHOLD_PARAMS
+        })
+    ranking = pd.DataFrame(rows).sort_values(['mean_iou', 'ms_per_image'], ascending=[False, True], kind='stable')
+    ranking.insert(0, 'rank', range(1, len(ranking) + 1))
+    ranking = ranking.reset_index(drop=True)
+    ranking.attrs['n_images'] = n_images
+    return ranking
+
+def main(overlay_dir="data/Ultrasound Fetus Dataset/OverlayedImages",
+         annotation_dir="data/Ultrasound Fetus Dataset/matched_dataset", output_path="parameter_sweep.csv",
+         grid=None, workers=None, limit=None, fmt='csv', top=10):
+    grid = grid or parameter_grid()
+    for path in (overlay_dir, annotation_dir):
+        if not os.path.exists(path):
+            print(f"Error: Directory not found at {path}")
+            return None
+
+    # Frames are decoded as the sweep consumes them, each exactly once
+    start_time = time.perf_counter()
+    ranking = sweep(iter_frames(overlay_dir, annotation_dir, limit), grid, workers)
+    sweep_seconds = time.perf_counter() - start_time
+    n_frames = ranking.attrs['n_images']
+    if not n_frames:
+        print("Error: No overlayed images with a matching annotation found")
+        return None
+    print(f"Evaluated {len(grid)} parameter sets on {n_frames} images ({len(grid) * n_frames} detections) "
+          f"in {sweep_seconds:.2f}s")
+
+    output_path = write_table(ranking, output_path, fmt)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(f"\nTop {min(top, len(ranking))} parameter sets:")
+        print(ranking.head(top).to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+    default = ranking[ranking['default']]
+    if not default.empty:
+        row = default.iloc[0]
+        print(f"\nCurrent defaults {THRESHOLD_PARAMS}: rank {row['rank']}, mean IoU {row['mean_iou']:.3f}, "
+              f"{row['ms_per_image']:.3f} ms/image")
+    print(f"\nRanking saved to: {output_path}")
+    return ranking
+
+def cli(argv=None, prog=None):
+    parser = sweep_parser(prog)
+    args = parser.parse_args(argv)
+    try:
+        grid = parameter_grid(args.block_sizes, args.constants, args.kernel_sizes)
+    except ValueError as e:
+        parser.error(str(e))
+    main(overlay_dir=args.overlay_dir, annotation_dir=args.annotation_dir, output_path=args.output, grid=grid,
+         workers=args.workers, limit=args.limit, fmt=args.format, top=args.top)
+
+if __name__ == "__main__":
+    cli()
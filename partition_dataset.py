@@ -1,30 +1,106 @@
 import os
-import shutil
-import random
+import hashlib
 from pathlib import Path
 import pandas as pd
+from materialize import Materializer
+from image_io import IMAGE_EXTENSIONS
+from profiling import PROFILER
+from catalog import default_catalog, file_image_number
+from arguments import partition_parser
 
-def partition_dataset(source_dir, output_base, train_ratio=0.7, val_ratio=0.15, test_ratio=0.15, seed=42):
+SPLITS = ['train', 'val', 'test']
+
+def assign_split(image_number, train_ratio=0.7, val_ratio=0.15, seed=42):
+    """
+    Assign an image to a split from a hash of its image number.
+    
+    The assignment depends only on the image number and seed, so it is the
+    same no matter which other images exist or what order they are seen in.
+    """
+    digest = hashlib.sha256(f"{seed}:{image_number}".encode()).digest()
+    u = int.from_bytes(digest[:8], 'big') / 2**64
+    if u < train_ratio:
+        return 'train'
+    if u < train_ratio + val_ratio:
+        return 'val'
+    return 'test'
+
+def image_split(filename, train_ratio=0.7, val_ratio=0.15, seed=42):
+    """Split of an image file, hashing its image number (or its name, if it has none)."""
+    number = file_image_number(filename)
+    return assign_split(filename if number is None else number, train_ratio, val_ratio, seed)
+
+def prune_partition(output_base, expected, scanned):
+    """
+    Remove images from the split directories that no longer belong there:
+    the current partition placed them in another split, or their source
+    file is confirmed gone.
+
+    Only the categories that were actually scanned are pruned, so a missing
+    or unreadable source directory never deletes anything.
+
+    Args:
+        output_base: Base directory of the partitioned dataset
+        expected: Set of destination paths the current partition placed
+        scanned: {category: source directory} of the categories that were listed
+
+    Returns:
+        Number of files removed
+    """
+    removed = 0
+    for category, category_path in scanned.items():
+        for split in SPLITS:
+            split_path = os.path.join(output_base, split, category)
+            if not os.path.exists(split_path):
+                continue
+            for img in default_catalog().listdir(split_path, IMAGE_EXTENSIONS):
+                path = os.path.join(split_path, img)
+                if path in expected:
+                    continue
+                moved = any(os.path.join(output_base, other, category, img) in expected
+                            for other in SPLITS if other != split)
+                if moved or not os.path.exists(os.path.join(category_path, img)):
+                    os.unlink(path)
+                    removed += 1
+    return removed
+
+def partition_dataset(source_dir, output_base, train_ratio=0.7, val_ratio=0.15, test_ratio=0.15, seed=42, mode='copy'):
     """
     Partition the dataset into train, validation, and test sets while maintaining class balance.
     
+    Each image's split comes from a hash of its image number (assign_split),
+    so it never depends on listing order or on which other images exist.
+    Categories are partitioned separately, each in the given proportions.
+    Images already in place are left untouched, so after new images are
+    added only those are placed; images whose source is gone are removed.
+    
     Args:
         source_dir: Directory containing the overlays organized by class
         output_base: Base directory for the partitioned dataset
         train_ratio: Proportion of data for training (default: 0.7)
         val_ratio: Proportion of data for validation (default: 0.15)
-        test_ratio: Proportion of data for testing (default: 0.15)
-        seed: Random seed for reproducibility
+        test_ratio: Proportion of data for testing (default: 0.15), the
+            remainder after train and validation
+        seed: Salt for the split hash; changing it reassigns every image
+        mode: How images are placed in the splits: 'copy', 'hardlink',
+            'reflink', 'symlink', or 'manifest' to write only an index of
+            split membership (partition_manifest.csv) and no image files
+    
+    Returns:
+        The Materializer holding a record of every placed image
     """
-    # Set random seed for reproducibility
-    random.seed(seed)
+    materializer = Materializer(mode, incremental=True)
     
     # Create output directories
-    for split in ['train', 'val', 'test']:
-        for category in ['normal', 'benign', 'malignant']:
-            os.makedirs(os.path.join(output_base, split, category), exist_ok=True)
+    os.makedirs(output_base, exist_ok=True)
+    if materializer.writes_files:
+        for split in SPLITS:
+            for category in ['normal', 'benign', 'malignant']:
+                os.makedirs(os.path.join(output_base, split, category), exist_ok=True)
     
     # Process each category
+    expected = set()
+    scanned = {}
     for category in ['normal', 'benign', 'malignant']:
         category_path = os.path.join(source_dir, category)
         if not os.path.exists(category_path):
@@ -32,39 +108,43 @@ def partition_dataset(source_dir, output_base, train_ratio=0.7, val_ratio=0.15,
             continue
         
         # Get all images in the category
-        images = [f for f in os.listdir(category_path) if f.endswith('.png')]
-        random.shuffle(images)
-        
-        # Calculate split indices
-        n_images = len(images)
-        n_train = int(n_images * train_ratio)
-        n_val = int(n_images * val_ratio)
-        
-        # Split the images
-        train_images = images[:n_train]
-        val_images = images[n_train:n_train + n_val]
-        test_images = images[n_train + n_val:]
+        with PROFILER.timer('listdir'):
+            images = default_catalog().listdir(category_path, IMAGE_EXTENSIONS)
+        scanned[category] = category_path
         
-        # Copy images to their respective directories
-        splits = {
-            'train': train_images,
-            'val': val_images,
-            'test': test_images
-        }
+        # Assign each image to its split
+        splits = {split: [] for split in SPLITS}
+        for img in sorted(images):
+            splits[image_split(img, train_ratio, val_ratio, seed)].append(img)
         
+        # Place images in their respective directories
         for split_name, split_images in splits.items():
             for img in split_images:
                 src = os.path.join(category_path, img)
                 dst = os.path.join(output_base, split_name, category, img)
-                shutil.copy2(src, dst)
+                materializer.place(src, dst, split=split_name, category=category, image=img)
+                expected.add(dst)
         
+        n_images = len(images)
+        if n_images == 0:
+            continue
         print(f"\nCategory: {category}")
         print(f"Total images: {n_images}")
-        print(f"Train: {len(train_images)} images ({len(train_images)/n_images*100:.1f}%)")
-        print(f"Validation: {len(val_images)} images ({len(val_images)/n_images*100:.1f}%)")
-        print(f"Test: {len(test_images)} images ({len(test_images)/n_images*100:.1f}%)")
+        print(f"Train: {len(splits['train'])} images ({len(splits['train'])/n_images*100:.1f}%)")
+        print(f"Validation: {len(splits['val'])} images ({len(splits['val'])/n_images*100:.1f}%)")
+        print(f"Test: {len(splits['test'])} images ({len(splits['test'])/n_images*100:.1f}%)")
+    
+    if not materializer.writes_files:
+        materializer.write_manifest(os.path.join(output_base, 'partition_manifest.csv'))
+    else:
+        removed = prune_partition(output_base, expected, scanned)
+        if removed:
+            print(f"\nRemoved {removed} images that no longer belong to their split")
+    print(f"\nMaterialized images: {materializer.summary()}")
+    
+    return materializer
 
-def main():
+def main(mode='copy', profile_report=None):
     # Define paths
     source_dir = "data/Ultrasound Fetus Dataset/Overlays"
     output_base = "data/Ultrasound Fetus Dataset/PartitionedOverlays"
@@ -75,29 +155,43 @@ def main():
     
     print("Starting dataset partitioning...")
     print("Using split ratios: 70% train, 15% validation, 15% test")
-    partition_dataset(source_dir, output_base)
+    with PROFILER.timer('partition_dataset.stage'):
+        materializer = partition_dataset(source_dir, output_base, mode=mode)
     
     # Create a summary CSV
     summary_data = []
     for split in ['train', 'val', 'test']:
         for category in ['normal', 'benign', 'malignant']:
             split_path = os.path.join(output_base, split, category)
-            if os.path.exists(split_path):
-                n_images = len([f for f in os.listdir(split_path) if f.endswith('.png')])
-                summary_data.append({
-                    'split': split,
-                    'category': category,
-                    'count': n_images
-                })
+            if not materializer.writes_files:
+                n_images = sum(1 for r in materializer.records if r['split'] == split and r['category'] == category)
+            elif os.path.exists(split_path):
+                n_images = len(default_catalog().listdir(split_path, IMAGE_EXTENSIONS))
+            else:
+                continue
+            summary_data.append({
+                'split': split,
+                'category': category,
+                'count': n_images
+            })
     
     # Save summary to CSV
     summary_df = pd.DataFrame(summary_data)
-    summary_df.to_csv(os.path.join(output_base, 'partition_summary.csv'), index=False)
+    with PROFILER.timer('csv_write'):
+        summary_df.to_csv(os.path.join(output_base, 'partition_summary.csv'), index=False)
     
     print("\nPartitioning complete!")
     print(f"Partitioned dataset saved to: {output_base}")
     print("\nPartition Summary:")
     print(summary_df.pivot(index='category', columns='split', values='count'))
+    
+    if profile_report:
+        PROFILER.write_report(profile_report)
+        print(f"Profile report saved to: {profile_report}")
+
+def cli(argv=None, prog=None):
+    args = partition_parser(prog).parse_args(argv)
+    main(mode=args.mode, profile_report=args.profile_report)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    cli()
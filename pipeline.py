@@ -0,0 +1,244 @@
+import os
+import queue
+import threading
+from collections import deque
+import cv2
+import pandas as pd
+from pathlib import Path
+from organize_dataset import build_image_index, health_to_category
+from generate_masks import create_ellipse_overlay, overlay_ellipse_params, fit_annotation_ellipse
+from partition_dataset import assign_split, SPLITS
+from catalog import CATEGORIES
+from image_io import read_image, write_image
+from columnar import TableWriter, write_table
+from shm_pool import SharedFramePool
+from arguments import pipeline_parser
+
+# Marks the end of a stage's output in its queue
+_DONE = object()
+
+def threaded(records, maxsize=8):
+    """
+    Run a generator stage in a background thread, buffering at most maxsize records.
+
+    The bounded queue is what keeps memory flat: a fast stage blocks once it
+    is maxsize records ahead of the stage consuming it. Exceptions raised in
+    the stage are re-raised in the consumer.
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        # Give up if the consumer has gone away, rather than block forever
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for record in records:
+                if not put(record):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(e)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            record = buffer.get()
+            if record is _DONE:
+                return
+            if isinstance(record, BaseException):
+                raise record
+            yield record
+    finally:
+        stop.set()
+
+def organize_stage(base_path):
+    """Yield one record per annotated image in Datasets/ that has a metadata row."""
+    base_path = Path(base_path)
+    datasets_path = base_path / 'Datasets'
+    metadata = pd.read_csv(base_path / 'FetusDataset.csv')
+    columns = list(metadata.columns)
+
+    image_index = build_image_index(datasets_path)
+    image_index = image_index[image_index['has_annotation'] & (image_index['image_number'] <= len(metadata))]
+    image_index = image_index.sort_values('image_number', kind='stable')
+
+    for img_number, filename, original_category in zip(
+            image_index['image_number'], image_index['image_filename'], image_index['original_category']):
+        # Note: image numbers in the dataset are 1-based, while DataFrame index is 0-based
+        row = dict(zip(columns, metadata.iloc[img_number - 1].tolist()))
+        category = health_to_category.get(row['fetal_health'], original_category)
+        source_dir = datasets_path / original_category
+        yield {
+            'image_number': int(img_number),
+            'image_filename': filename,
+            'category': category,
+            'original_path': source_dir / filename,
+            'annotation_path': source_dir / f"{filename[:-len('.png')]}_Annotation.png",
+            'metadata': row
+        }
+
+def fit_stage(records):
+    """Fit the annotation ellipse for each record, dropping records that can't be fit."""
+    for record in records:
+        annotation = read_image(record['annotation_path'], cv2.IMREAD_GRAYSCALE, cache=False)
+        if annotation is None:
+            print(f"Could not read image: {record['annotation_path']}")
+            continue
+
+        # Threshold to binary and fit ellipse to the largest contour
+        fit = fit_annotation_ellipse(annotation)
+        if fit.ellipse is None:
+            print(f"Could not fit ellipse in: {record['annotation_path'].name}")
+            continue
+
+        record['ellipse_params'] = overlay_ellipse_params(fit.ellipse)
+        yield record
+
+def _read_originals(records):
+    for record in records:
+        original = read_image(record['original_path'], cache=False)
+        if original is None:
+            print(f"Could not read original image: {record['original_path']}")
+            continue
+        yield record, original
+
+def overlay_stage(records, pool=None):
+    """
+    Read each original image once and render its overlay.
+
+    With a shm_pool.SharedFramePool the rendering runs in its worker
+    processes, the frames passing through shared memory.
+    """
+    if pool is None:
+        for record, original in _read_originals(records):
+            record['overlay'] = create_ellipse_overlay(original, record['ellipse_params'], inplace=True)
+            yield record
+        return
+
+    # Results come back in submission order, so records queue up alongside them
+    submitted = deque()
+
+    def tasks():
+        for record, original in _read_originals(records):
+            submitted.append(record)
+            yield original, (record['ellipse_params'],)
+
+    for overlay in pool.imap('overlay', tasks()):
+        record = submitted.popleft()
+        record['overlay'] = overlay
+        yield record
+
+def partition_stage(records, train_ratio=0.7, val_ratio=0.15, seed=42):
+    """Assign each record to a split by hashing its image number."""
+    for record in records:
+        record['split'] = assign_split(record['image_number'], train_ratio, val_ratio, seed)
+        yield record
+
+def correlate_stage(records, overlay_dir, metadata_dir, codec='png'):
+    """
+    Write each overlay into its split/category directory and stream its metadata row.
+
+    This is the only stage that writes to disk. The per-split metadata CSVs
+    have the same columns as correlate_metadata's output and, like every
+    table, only appear (atomically) once the whole stream went through.
+    """
+    os.makedirs(overlay_dir, exist_ok=True)
+    os.makedirs(metadata_dir, exist_ok=True)
+    writers = {}
+    counts = {}
+    try:
+        for record in records:
+            split, category = record['split'], record['category']
+            category_output = Path(overlay_dir) / split / category
+            category_output.mkdir(parents=True, exist_ok=True)
+            overlay_path = write_image(category_output / f"overlay_{record['image_filename']}", record['overlay'], codec)
+            overlay_name = os.path.basename(overlay_path)
+
+            row = dict(record['metadata'])
+            row.update({'image_filename': overlay_name, 'category': category, 'split': split})
+            if split not in writers:
+                writers[split] = TableWriter(os.path.join(metadata_dir, f'{split}_metadata.csv'))
+            writers[split].write(row)
+
+            counts[(split, category)] = counts.get((split, category), 0) + 1
+            yield record
+    except BaseException as e:
+        # Leave any previous tables in place
+        for writer in writers.values():
+            writer.__exit__(type(e), e, e.__traceback__)
+        raise
+    for writer in writers.values():
+        writer.close()
+
+    # Record the split sizes, in the same order as partition_dataset's summary
+    summary = [{'split': s, 'category': c, 'count': counts[(s, c)]}
+               for s in SPLITS for c in CATEGORIES if (s, c) in counts]
+    write_table(pd.DataFrame(summary, columns=['split', 'category', 'count']),
+                os.path.join(overlay_dir, 'partition_summary.csv'))
+
+def run_pipeline(base_path, overlay_dir, metadata_dir, queue_size=8, seed=42, codec='png', render_workers=0):
+    """
+    Run organize -> fit -> overlay -> partition -> correlate as one streaming pass.
+
+    Each image is read from disk once and only the partitioned overlays and
+    the per-split metadata CSVs are written. Stages run in their own threads
+    connected by queues of at most queue_size records, so memory use does not
+    grow with the size of the dataset. Overlays are written with codec.
+
+    With render_workers > 0 the overlays are rendered in that many worker
+    processes (see shm_pool.SharedFramePool).
+
+    Returns a dict of (split, category) -> number of images written.
+    """
+    pool = SharedFramePool(render_workers) if render_workers > 0 else None
+    try:
+        records = threaded(organize_stage(base_path), queue_size)
+        records = threaded(fit_stage(records), queue_size)
+        records = threaded(overlay_stage(records, pool), queue_size)
+        records = partition_stage(records, seed=seed)
+
+        counts = {}
+        for record in correlate_stage(records, overlay_dir, metadata_dir, codec):
+            key = (record['split'], record['category'])
+            counts[key] = counts.get(key, 0) + 1
+            print(f"Processed: {record['image_filename']} -> {record['split']}/{record['category']}")
+    finally:
+        if pool is not None:
+            pool.close()
+    return counts
+
+def main(queue_size=8, codec='png', render_workers=0):
+    base_path = "data/Ultrasound Fetus Dataset"
+    overlay_dir = "data/Ultrasound Fetus Dataset/PartitionedElipseOverlays"
+    metadata_dir = "data/Ultrasound Fetus Dataset/PartitionedMetadata"
+
+    if not os.path.exists(os.path.join(base_path, 'Datasets')):
+        print(f"Error: Dataset directory not found at {os.path.join(base_path, 'Datasets')}")
+        return
+
+    print("Starting streaming pipeline...")
+    counts = run_pipeline(base_path, overlay_dir, metadata_dir, queue_size, codec=codec, render_workers=render_workers)
+
+    print("\nPipeline complete!")
+    print(f"Total images processed: {sum(counts.values())}")
+    for split in SPLITS:
+        split_counts = {c: n for (s, c), n in counts.items() if s == split}
+        print(f"{split}: {sum(split_counts.values())} images {split_counts}")
+    print(f"\nOverlays have been saved to: {overlay_dir}")
+    print(f"Metadata files have been saved to: {metadata_dir}")
+
+def cli(argv=None, prog=None):
+    args = pipeline_parser(prog).parse_args(argv)
+    main(queue_size=args.queue_size, codec=args.codec, render_workers=args.render_workers)
+
+if __name__ == "__main__":
+    cli()
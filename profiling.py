@@ -0,0 +1,167 @@
+import json
+import math
+import time
+import threading
+
+class _Timer:
+    """Context manager that records the time spent in its block."""
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, time.perf_counter_ns() - self.start)
+        return False
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+# Histogram buckets per doubling of duration: bucket edges are 2**(1/16)
+# apart, so a reported percentile is within about 2.2% of the exact one
+BUCKETS_PER_OCTAVE = 16
+
+class StepStats:
+    """
+    Constant-memory summary of one step's durations: exact count, total,
+    min and max, plus a log-scale histogram for percentiles.
+
+    The histogram has one bucket per 2**(1/16) ratio of durations, so a
+    step's memory grows with the spread of its durations (a few hundred
+    buckets at most), never with how often it runs.
+    """
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.buckets = {}
+
+    def add(self, duration_ns):
+        self.count += 1
+        self.total += duration_ns
+        self.min = duration_ns if self.min is None else min(self.min, duration_ns)
+        self.max = max(self.max, duration_ns)
+        bucket = int(math.log2(duration_ns) * BUCKETS_PER_OCTAVE) if duration_ns > 0 else -1
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def update(self, other):
+        """Add the durations summarized by another StepStats."""
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+    def percentile(self, q):
+        """Approximate q-th percentile (0-100): the geometric middle of the bucket holding it."""
+        if not self.count:
+            return 0
+        rank = (self.count - 1) * q / 100
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen > rank:
+                break
+        if bucket < 0:
+            return 0
+        middle = 2 ** ((bucket + 0.5) / BUCKETS_PER_OCTAVE)
+        return min(max(middle, self.min), self.max)
+
+class Profiler:
+    """
+    Collects wall-clock durations of named steps.
+
+    Each timed block costs two perf_counter_ns calls and a histogram
+    update under a lock, a microsecond or so, against steps (imread,
+    adaptiveThreshold, ...) that take milliseconds. Memory per step stays
+    constant however long the run (see StepStats), so it is left on by
+    default.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.steps = {}
+        self._lock = threading.Lock()
+
+    def timer(self, name):
+        """Time a block: `with PROFILER.timer('imread'): ...`."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def record(self, name, duration_ns):
+        with self._lock:
+            stats = self.steps.get(name)
+            if stats is None:
+                stats = self.steps[name] = StepStats()
+            stats.add(duration_ns)
+
+    def drain(self):
+        """
+        Return the collected step summaries and start over.
+
+        Used to ship samples out of worker processes; the summaries are
+        small and picklable, and merge() adds them to the parent's profiler.
+        """
+        with self._lock:
+            steps, self.steps = self.steps, {}
+        return steps
+
+    def merge(self, steps):
+        """Add step summaries drained from another profiler."""
+        with self._lock:
+            for name, other in steps.items():
+                stats = self.steps.get(name)
+                if stats is None:
+                    stats = self.steps[name] = StepStats()
+                stats.update(other)
+
+    def report(self):
+        """Summarize each step: count, total and p50/p95/p99/max latency in milliseconds."""
+        summary = {}
+        # Under the lock: other threads may be adding to the same histograms
+        with self._lock:
+            for name in sorted(self.steps):
+                stats = self.steps[name]
+                summary[name] = {
+                    'count': stats.count,
+                    'total_ms': stats.total / 1e6,
+                    'mean_ms': stats.total / stats.count / 1e6,
+                    'p50_ms': stats.percentile(50) / 1e6,
+                    'p95_ms': stats.percentile(95) / 1e6,
+                    'p99_ms': stats.percentile(99) / 1e6,
+                    'max_ms': stats.max / 1e6
+                }
+        return summary
+
+    def write_report(self, path):
+        """Save the report as JSON."""
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def print_report(self):
+        print(f"\n{'step':<40} {'count':>7} {'total ms':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for name, stats in self.report().items():
+            print(f"{name:<40} {stats['count']:>7} {stats['total_ms']:>10.1f} "
+                  f"{stats['p50_ms']:>8.3f} {stats['p95_ms']:>8.3f} {stats['p99_ms']:>8.3f}")
+
+# Shared profiler used by all the pipeline scripts
+PROFILER = Profiler()
@@ -0,0 +1,53 @@
+import os
+import hashlib
+import argparse
+from catalog import file_image_number
+
+def parse_shard(text):
+    """Parse an 'i/N' shard spec (0 <= i < N) into an (i, N) tuple, for argparse."""
+    index, sep, count = text.partition('/')
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        sep = ''
+    if not sep or count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Invalid shard: {text} (expected i/N with 0 <= i < N)")
+    return index, count
+
+def shard_of(key, n_shards):
+    """Deterministically map a key (an image number) to one of n_shards shards."""
+    digest = hashlib.sha256(str(key).encode()).digest()
+    return int.from_bytes(digest[:8], 'big') % n_shards
+
+def in_shard(filename, shard):
+    """
+    Check whether an image file belongs to a shard.
+
+    Images are assigned by their image number, so an image, its annotation
+    and its overlay always land on the same shard. Files without an image
+    number are assigned by name. A shard of None selects every file.
+    """
+    if shard is None:
+        return True
+    index, n_shards = shard
+    number = file_image_number(filename)
+    return shard_of(filename if number is None else number, n_shards) == index
+
+def shard_path(path, shard):
+    """Per-shard variant of an output path, e.g. results.csv -> results.shard-0-of-4.csv."""
+    if shard is None:
+        return str(path)
+    stem, ext = os.path.splitext(str(path))
+    return f"{stem}.shard-{shard[0]}-of-{shard[1]}{ext}"
+
+def shard_paths(path, n_shards):
+    """
+    The per-shard outputs of all n_shards shards, checking they all exist.
+
+    Raises FileNotFoundError naming the missing shards otherwise.
+    """
+    paths = [shard_path(path, (index, n_shards)) for index in range(n_shards)]
+    missing = [p for p in paths if not os.path.exists(p)]
+    if missing:
+        raise FileNotFoundError(f"Missing shard outputs (run those shards first): {', '.join(missing)}")
+    return paths
@@ -0,0 +1,248 @@
+import os
+import pickle
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from profiling import PROFILER
+
+class FrameRing:
+    """
+    A ring of fixed-size frame slots in one shared memory block.
+
+    The parent copies decoded frames into free slots; worker processes
+    attach to the same block by name and read (or render into) a slot
+    through a NumPy view, so frames never go through pickle.
+    """
+
+    def __init__(self, n_slots, slot_bytes, name=None):
+        self.n_slots = n_slots
+        self.slot_bytes = slot_bytes
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=n_slots * slot_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def view(self, slot, shape, dtype):
+        """A NumPy view of the frame stored in a slot."""
+        return np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+    def put(self, slot, image):
+        """Copy a frame into a slot, returning the (shape, dtype) needed to view it."""
+        if image.nbytes > self.slot_bytes:
+            raise ValueError(f"Frame of {image.nbytes} bytes does not fit a {self.slot_bytes} byte slot")
+        self.view(slot, image.shape, image.dtype)[...] = image
+        return image.shape, image.dtype.str
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def _detect(image, *args):
+    """Detect the ellipse in an overlayed frame, returning only the small fit record."""
+    from extract_ellipse_params import detect_mask_ellipse
+    fit = detect_mask_ellipse(image, *args)
+    return {'ellipse': fit.ellipse, 'contour_area': fit.contour_area,
+            'perimeter': fit.perimeter, 'circularity': float(fit.circularity)}
+
+def _overlay(image, ellipse_params):
+    """Render an overlay into the frame's own slot; the parent reads it back from the ring."""
+    from generate_masks import create_ellipse_overlay
+    overlay = create_ellipse_overlay(image, ellipse_params, inplace=True)
+    if overlay is not image:
+        # Frames that aren't 3-channel are rendered into a new array
+        image[...] = overlay
+
+def _sweep(image, grid, truth):
+    """Score every detection parameter set on a grayscale frame, returning one small record per set."""
+    from parameter_sweep import evaluate_frame
+    return evaluate_frame(image, grid, truth)
+
+# Operations workers can run on a frame: name -> (function, writes the frame back)
+OPERATIONS = {
+    'detect': (_detect, False),
+    'overlay': (_overlay, True),
+    'sweep': (_sweep, False)
+}
+
+def _process_context():
+    """Forking a multi-threaded process is unsafe, so prefer a forkserver."""
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+# The ring a worker process attached to in its initializer
+_worker_ring = None
+
+def _attach(name, n_slots, slot_bytes):
+    global _worker_ring
+    _worker_ring = FrameRing(n_slots, slot_bytes, name)
+
+def _run_slot(operation, slot, shape, dtype, args):
+    """Run an operation on the frame in a slot, in a worker process."""
+    func, _ = OPERATIONS[operation]
+    return func(_worker_ring.view(slot, shape, dtype), *args), PROFILER.drain()
+
+def _run_frame(operation, image, args):
+    """Run an operation on a pickled frame (the naive pool), returning the frame if it was rendered into."""
+    func, writes_frame = OPERATIONS[operation]
+    result = func(image, *args)
+    return (image if writes_frame else result), PROFILER.drain()
+
+class SharedFramePool:
+    """
+    Process pool that hands frames to its workers through a FrameRing.
+
+    Each task sends only a slot index, shape, dtype and the operation's
+    small arguments; workers return small result records (or render into
+    the slot). The ring is sized from the first frame unless slot_bytes is
+    given; a frame larger than a slot is pickled to a worker instead (and
+    rendered frames pickled back), like PickledFramePool does.
+
+    Workers are started from a forkserver where available, so the pool can
+    be created from a thread of a multi-threaded process (like the
+    streaming pipeline's stages). Run one imap at a time per pool.
+
+    With measure_ipc, ipc_bytes counts the pickled size of every task and
+    everything returned by the workers (results and profiler samples).
+
+    Use as a context manager, or call close() to stop the workers and free
+    the shared memory.
+    """
+
+    def __init__(self, workers=None, n_slots=None, slot_bytes=None, measure_ipc=False):
+        self.workers = workers or os.cpu_count() or 1
+        self.n_slots = n_slots or 2 * self.workers + 2
+        self.slot_bytes = slot_bytes
+        self.measure_ipc = measure_ipc
+        self.ring = None
+        self.executor = None
+        self.ipc_bytes = 0
+
+    def _start(self, slot_bytes):
+        self.ring = FrameRing(self.n_slots, slot_bytes)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_process_context(),
+                                            initializer=_attach, initargs=(self.ring.name, self.n_slots, slot_bytes))
+
+    def imap(self, operation, tasks, copy=True):
+        """
+        Run an operation ('detect', 'overlay' or 'sweep') over (image, args) pairs,
+        yielding the results in order.
+
+        Frames are copied into the ring as slots free up, so at most n_slots
+        frames are in flight. For 'overlay' the rendered frame is yielded: a
+        copy by default, or with copy=False a view into the ring that is
+        only valid until the next result is requested.
+        """
+        _, writes_frame = OPERATIONS[operation]
+        free = deque(range(self.n_slots))
+        pending = deque()
+
+        def finish():
+            slot, shape, dtype, future = pending.popleft()
+            returned = future.result()
+            if self.measure_ipc:
+                self.ipc_bytes += len(pickle.dumps(returned))
+            result, samples = returned
+            PROFILER.merge(samples)
+            if writes_frame and slot is not None:
+                result = self.ring.view(slot, shape, dtype)
+                if copy:
+                    result = result.copy()
+            return slot, result
+
+        for image, args in tasks:
+            if self.ring is None:
+                self._start(self.slot_bytes or image.nbytes)
+            if image.nbytes > self.ring.slot_bytes:
+                # Too big for a slot: send this frame through pickle instead
+                if len(pending) >= self.n_slots:
+                    slot, result = finish()
+                    yield result
+                    if slot is not None:
+                        free.append(slot)
+                message = (operation, image, tuple(args))
+                if self.measure_ipc:
+                    self.ipc_bytes += len(pickle.dumps(message))
+                pending.append((None, None, None, self.executor.submit(_run_frame, *message)))
+                continue
+            while not free:
+                slot, result = finish()
+                yield result
+                if slot is not None:
+                    free.append(slot)
+            slot = free.popleft()
+            with PROFILER.timer('shm_put'):
+                shape, dtype = self.ring.put(slot, image)
+            message = (operation, slot, shape, dtype, tuple(args))
+            if self.measure_ipc:
+                self.ipc_bytes += len(pickle.dumps(message))
+            pending.append((slot, shape, dtype, self.executor.submit(_run_slot, *message)))
+
+        while pending:
+            slot, result = finish()
+            yield result
+            if slot is not None:
+                free.append(slot)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+        if self.ring is not None:
+            self.ring.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class PickledFramePool:
+    """
+    Process pool with the same interface that pickles every frame to its
+    workers (and rendered frames back), for comparison with SharedFramePool.
+    """
+
+    def __init__(self, workers=None, n_slots=None, measure_ipc=False):
+        self.workers = workers or os.cpu_count() or 1
+        self.n_slots = n_slots or 2 * self.workers + 2
+        self.measure_ipc = measure_ipc
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_process_context())
+        self.ipc_bytes = 0
+
+    def imap(self, operation, tasks, copy=True):
+        pending = deque()
+
+        def finish():
+            returned = pending.popleft().result()
+            if self.measure_ipc:
+                self.ipc_bytes += len(pickle.dumps(returned))
+            result, samples = returned
+            PROFILER.merge(samples)
+            return result
+
+        for image, args in tasks:
+            if len(pending) >= self.n_slots:
+                yield finish()
+            message = (operation, image, tuple(args))
+            if self.measure_ipc:
+                self.ipc_bytes += len(pickle.dumps(message))
+            pending.append(self.executor.submit(_run_frame, *message))
+
+        while pending:
+            yield finish()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
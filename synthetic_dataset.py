@@ -0,0 +1,101 @@
+import os
+import cv2
+import numpy as np
+import pandas as pd
+from organize_dataset import MATCHED_COLUMNS, health_to_category
+from arguments import synthetic_parser
+
+CATEGORIES = ['normal', 'benign', 'malignant']
+
+# FetusDataset.csv columns: the metadata columns of matched_data.csv under their original names
+FETUS_COLUMNS = ['baseline value' if c == 'baseline_value' else c for c in MATCHED_COLUMNS[MATCHED_COLUMNS.index('fetal_health'):]]
+
+def random_ellipse(rng, height, width):
+    """Pick a random ellipse (center, half-axes, angle) that fits well inside the frame."""
+    center = (int(rng.integers(width // 3, 2 * width // 3)), int(rng.integers(height // 3, 2 * height // 3)))
+    axes = (int(rng.integers(width // 10, width // 5)), int(rng.integers(height // 10, height // 5)))
+    return center, axes, float(rng.uniform(0, 180))
+
+def synthetic_ultrasound(rng, height=480, width=640):
+    """Create a fake ultrasound frame: blurred speckle noise."""
+    image = rng.integers(0, 120, size=(height, width), dtype=np.uint8)
+    image = cv2.GaussianBlur(image, (5, 5), 0)
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+def synthetic_annotation(ellipse, height=480, width=640):
+    """Create an annotation mask: the ellipse filled white on black."""
+    mask = np.zeros((height, width), dtype=np.uint8)
+    center, axes, angle = ellipse
+    cv2.ellipse(mask, center, axes, angle, 0, 360, 255, -1)
+    return mask
+
+def draw_overlay(image, ellipse):
+    """Draw an ellipse on an image the way the overlayed images look (green, blended)."""
+    center, axes, angle = ellipse
+    overlay = image.copy()
+    cv2.ellipse(overlay, center, axes, angle, 0, 360, (0, 255, 0), 2)
+    return cv2.addWeighted(overlay, 0.7, image, 0.3, 0)
+
+def synthetic_overlay(rng, height=480, width=640):
+    """Create a fake overlayed ultrasound frame: speckle noise with a green ellipse drawn on it."""
+    return draw_overlay(synthetic_ultrasound(rng, height, width), random_ellipse(rng, height, width))
+
+def generate_dataset(root, n_images=100, height=480, width=640, seed=0):
+    """
+    Write a fake Ultrasound Fetus Dataset under root, fully offline.
+
+    Creates the layout the pipeline scripts expect:
+        Datasets/{category}/{n}_HC.png and {n}_HC_Annotation.png
+        OverlayedImages/{category}/{n}_HC.png
+        FetusDataset.csv (row n describes image n, fetal_health matching its category)
+
+    Returns a DataFrame of the ground-truth ellipses.
+    """
+    rng = np.random.default_rng(seed)
+    category_health = {category: health for health, category in health_to_category.items()}
+    for category in CATEGORIES:
+        os.makedirs(os.path.join(root, 'Datasets', category), exist_ok=True)
+        os.makedirs(os.path.join(root, 'OverlayedImages', category), exist_ok=True)
+
+    rows = []
+    truth = []
+    for img_number in range(1, n_images + 1):
+        category = CATEGORIES[int(rng.integers(len(CATEGORIES)))]
+        ellipse = random_ellipse(rng, height, width)
+        image = synthetic_ultrasound(rng, height, width)
+        filename = f"{img_number}_HC.png"
+
+        cv2.imwrite(os.path.join(root, 'Datasets', category, filename), image)
+        cv2.imwrite(os.path.join(root, 'Datasets', category, f"{img_number}_HC_Annotation.png"),
+                    synthetic_annotation(ellipse, height, width))
+        cv2.imwrite(os.path.join(root, 'OverlayedImages', category, filename), draw_overlay(image, ellipse))
+
+        row = dict(zip(FETUS_COLUMNS, rng.uniform(0, 100, size=len(FETUS_COLUMNS)).round(3)))
+        row['fetal_health'] = category_health[category]
+        rows.append(row)
+        (center_x, center_y), (axis_x, axis_y), angle = ellipse
+        truth.append({
+            'image_number': img_number,
+            'category': category,
+            'center_x': center_x,
+            'center_y': center_y,
+            'axis_x': axis_x,
+            'axis_y': axis_y,
+            'angle': angle
+        })
+
+    pd.DataFrame(rows, columns=FETUS_COLUMNS).to_csv(os.path.join(root, 'FetusDataset.csv'), index=False)
+    return pd.DataFrame(truth)
+
+def main(root, n_images=100, height=480, width=640, seed=0):
+    print(f"Generating {n_images} synthetic images ({width}x{height}) in {root}...")
+    truth = generate_dataset(root, n_images, height, width, seed)
+    print("\nImages per category:")
+    print(truth['category'].value_counts())
+
+def cli(argv=None, prog=None):
+    args = synthetic_parser(prog).parse_args(argv)
+    main(args.root, args.n_images, args.height, args.width, args.seed)
+
+if __name__ == "__main__":
+    cli()